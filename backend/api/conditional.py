@@ -0,0 +1,98 @@
+"""
+Условные запросы: ETag и Last-Modified строятся по времени
+последнего изменения данных, а не по телу ответа, поэтому
+при 304 сериализация не выполняется.
+"""
+import hashlib
+import time
+from functools import wraps
+
+from django.core.cache import cache
+from django.db import transaction
+from django.utils.cache import (get_conditional_response,
+                                patch_cache_control,
+                                patch_vary_headers)
+from django.utils.http import http_date, quote_etag
+
+CACHE_PREFIX = 'conditional'
+RECIPES = 'recipes'
+TAGS = 'tags'
+INGREDIENTS = 'ingredients'
+
+
+def state_key(scope):
+    return f'{CACHE_PREFIX}:{scope}'
+
+
+def user_scope(user_id):
+    return f'user:{user_id}'
+
+
+def touch(*scopes):
+    """
+    Отмечает изменение данных: все прежние ETag устаревают.
+    Внутри транзакции отметка ставится после её фиксации, иначе
+    параллельный запрос получил бы новый ETag для старых данных.
+    """
+    transaction.on_commit(lambda: mark_changed(scopes))
+
+
+def mark_changed(scopes):
+    now = time.time()
+    cache.set_many({state_key(scope): now for scope in scopes},
+                   timeout=None)
+
+
+def touch_user(user_id):
+    """Изменились избранное, список покупок или подписки пользователя."""
+    touch(user_scope(user_id))
+
+
+def changed_at(scopes):
+    """Время последнего изменения каждой области."""
+    keys = {scope: state_key(scope) for scope in scopes}
+    values = cache.get_many(keys.values())
+    missing = {key: time.time() for key in keys.values()
+               if key not in values}
+    if missing:
+        # После сброса кеша считаем, что изменилось всё.
+        for key, value in missing.items():
+            cache.add(key, value, timeout=None)
+        values.update(cache.get_many(missing))
+    return [values[keys[scope]] for scope in scopes]
+
+
+def conditional(*scopes, user=False, public=False, max_age=0):
+    """
+    Отвечает 304 на GET и HEAD, если данные областей scopes
+    (и, с user=True, связи пользователя) не менялись.
+    public разрешает общим кешам хранить ответ max_age секунд.
+    """
+    def decorator(method):
+        @wraps(method)
+        def wrapper(self, request, *args, **kwargs):
+            request_scopes = list(scopes)
+            if user and request.user.is_authenticated:
+                request_scopes.append(user_scope(request.user.id))
+            times = changed_at(request_scopes)
+            state = (request_scopes, times, request.get_full_path(),
+                     request.accepted_media_type)
+            etag = quote_etag(hashlib.md5(repr(state).encode()).hexdigest())
+            last_modified = int(max(times))
+            response = get_conditional_response(
+                request, etag=etag, last_modified=last_modified)
+            if response is None:
+                response = method(self, request, *args, **kwargs)
+            if response.status_code in (200, 304):
+                response['ETag'] = etag
+                response['Last-Modified'] = http_date(last_modified)
+                if public and not request.auth:
+                    patch_cache_control(response, public=True,
+                                        max_age=max_age)
+                else:
+                    patch_cache_control(response, private=True,
+                                        no_cache=True)
+                patch_vary_headers(response, ('Accept', 'Authorization'))
+            return response
+        return wrapper
+    return decorator
@@ -1,23 +1,44 @@
+from django import forms
+from django.db.models import Exists, OuterRef
 from django_filters.rest_framework import filters, FilterSet
 
-from recipes.models import Recipe, Ingredient
+from api.tag_registry import tag_registry
+from recipes.models import Favorite, Recipe, ShoppingCart
 from users.models import User
 
 
-class IngredientFilter(FilterSet):
-    name = filters.CharFilter(lookup_expr='istartswith')
-
-    class Meta:
-        model = Ingredient
-        fields = ('name',)
-
-
 IN_NOT_IN = (
     (0, 'Not_In'),
     (1, 'In'),
 )
 
 
+class TagSlugsField(forms.Field):
+    """Несколько слагов тегов, переведённые в id по реестру тегов."""
+    widget = forms.MultipleHiddenInput
+    default_error_messages = {
+        'invalid_choice': forms.MultipleChoiceField.default_error_messages[
+            'invalid_choice'],
+    }
+
+    def to_python(self, value):
+        if not value:
+            return []
+        tag_ids = tag_registry.slug_ids()
+        for slug in value:
+            if slug not in tag_ids:
+                raise forms.ValidationError(
+                    self.error_messages['invalid_choice'],
+                    code='invalid_choice',
+                    params={'value': slug},
+                )
+        return sorted({tag_ids[slug] for slug in value})
+
+
+class TagSlugsFilter(filters.Filter):
+    field_class = TagSlugsField
+
+
 class RecipeFilter(FilterSet):
     """Фильтрация рецептов."""
 
@@ -31,8 +52,8 @@ class RecipeFilter(FilterSet):
         choices=IN_NOT_IN,
         method='get_is_in'
     )
-    tags = filters.AllValuesMultipleFilter(
-        field_name='tags__slug',
+    tags = TagSlugsFilter(
+        method='get_tags',
         label='Ссылка'
     )
 
@@ -44,11 +65,24 @@ class RecipeFilter(FilterSet):
         if user.is_authenticated:
             if value == '1':
                 if name == 'is_favorited':
-                    queryset = queryset.filter(favorites_recipes__user=user)
+                    queryset = queryset.filter(Exists(Favorite.objects.filter(
+                        user=user, recipe=OuterRef('pk'))))
                 if name == 'is_in_shopping_cart':
-                    queryset = queryset.filter(recipe_shopping_cart__user=user)
+                    queryset = queryset.filter(Exists(
+                        ShoppingCart.objects.filter(
+                            user=user, recipe=OuterRef('pk'))))
         return queryset
 
+    def get_tags(self, queryset, name, value):
+        """
+        Рецепты хотя бы с одним из тегов: EXISTS вместо
+        соединения, поэтому без повторов.
+        """
+        if not value:
+            return queryset
+        return queryset.filter(Exists(Recipe.tags.through.objects.filter(
+            recipe=OuterRef('pk'), tag_id__in=value)))
+
     class Meta:
         model = Recipe
         fields = ['is_favorited', 'is_in_shopping_cart', 'author', 'tags']
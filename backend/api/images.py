@@ -0,0 +1,272 @@
+"""
+Фоновая обработка картинок рецептов. В запросе загрузка
+только декодируется во временный файл, проверяется
+по заголовку и сохраняется в закрытое хранилище.
+Полная проверка, удаление метаданных, пересжатие
+и уменьшенные копии (api.thumbnails) делаются пулом
+потоков после фиксации транзакции; до этого рецепт
+помечен как обрабатываемый и картинки у него нет.
+"""
+import base64
+import binascii
+import io
+import logging
+import os
+import re
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from django import forms
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import TemporaryUploadedFile
+from django.db import close_old_connections, connections, transaction
+from PIL import Image, ImageOps
+
+from api import recipe_fragments, thumbnails
+from api.conditional import RECIPES, touch
+from recipes.models import Recipe
+from recipes.storage import UploadStorage
+
+logger = logging.getLogger(__name__)
+
+# Порция base64, кратная 4 символам, декодируется без остатка.
+CHUNK_SIZE = 64 * 1024
+WHITESPACE = re.compile(r'\s+')
+FORMATS = ('JPEG', 'PNG', 'GIF', 'WEBP')
+
+# Необработанные загрузки с исходными метаданными (EXIF, GPS).
+upload_storage = UploadStorage()
+UPLOAD_DIR = 'recipes'
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def decode_base64(data):
+    """
+    data:-строку base64 по частям во временный файл:
+    декодированная картинка целиком в памяти не держится.
+    """
+    header, encoded = data.split(';base64,', 1)
+    if WHITESPACE.search(encoded):
+        encoded = WHITESPACE.sub('', encoded)
+    upload = TemporaryUploadedFile(
+        name='temp.' + header.split('/')[-1],
+        content_type=header[len('data:'):],
+        size=0,
+        charset=None,
+    )
+    try:
+        for start in range(0, len(encoded), CHUNK_SIZE):
+            upload.write(base64.b64decode(
+                encoded[start:start + CHUNK_SIZE], validate=True))
+    except binascii.Error:
+        upload.close()
+        raise
+    upload.size = upload.tell()
+    upload.seek(0)
+    return upload
+
+
+class HeaderImageField(forms.ImageField):
+    """Картинка, проверенная в запросе только по заголовку."""
+
+    def to_python(self, data):
+        upload = forms.FileField.to_python(self, data)
+        if upload is None:
+            return None
+        try:
+            with Image.open(upload) as image:
+                if image.format not in FORMATS:
+                    raise ValueError(image.format)
+                upload.content_type = Image.MIME.get(image.format)
+        except Exception as error:
+            raise forms.ValidationError(
+                self.error_messages['invalid_image'],
+                code='invalid_image',
+            ) from error
+        upload.seek(0)
+        return upload
+
+
+def store_upload(upload):
+    """Сохраняет загрузку в закрытое хранилище и возвращает имя."""
+    name = upload_storage.save(
+        os.path.join(UPLOAD_DIR, os.path.basename(upload.name)), upload)
+    upload.close()
+    return name
+
+
+def accept(recipe, upload):
+    """
+    Новая картинка рецепта ждёт обработки в закрытом
+    хранилище; прежняя удаляется после фиксации.
+    """
+    release(recipe.image.name, recipe.image_variants)
+    recipe.image = ''
+    recipe.image_variants = {}
+    recipe.image_upload = store_upload(upload) if upload else ''
+    recipe.image_status = (Recipe.IMAGE_PROCESSING if upload
+                           else Recipe.IMAGE_READY)
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=settings.IMAGE_WORKERS,
+                    thread_name_prefix='recipe-images',
+                )
+    return _executor
+
+
+def schedule(recipe):
+    """Обработка картинки рецепта после фиксации транзакции."""
+    recipe_id, source = recipe.id, recipe.image_upload
+    if settings.IMAGE_WORKERS:
+        transaction.on_commit(
+            lambda: get_executor().submit(run, recipe_id, source))
+    else:
+        transaction.on_commit(lambda: process(recipe_id, source))
+
+
+def run(recipe_id, source):
+    close_old_connections()
+    try:
+        process(recipe_id, source)
+    except Exception:
+        logger.exception('Не удалось обработать картинку рецепта %s',
+                         recipe_id)
+    finally:
+        connections.close_all()
+
+
+def prepare(image):
+    """
+    Картинка в нужной ориентации, уменьшенная до
+    RECIPE_IMAGE_MAX_SIDE, и формат для её сохранения:
+    PNG при прозрачности, иначе JPEG. Метаданные
+    при пересжатии не сохраняются.
+    """
+    image = ImageOps.exif_transpose(image)
+    image.thumbnail((settings.RECIPE_IMAGE_MAX_SIDE,) * 2)
+    if image.mode in ('RGBA', 'LA') or 'transparency' in image.info:
+        return image.convert('RGBA'), 'PNG'
+    return image.convert('RGB'), 'JPEG'
+
+
+def release(name, variants=None):
+    """
+    После фиксации транзакции удаляет файл картинки и её копии,
+    если на картинку больше не ссылается ни один рецепт.
+    """
+    transaction.on_commit(lambda: delete_unused(name, variants or {}))
+
+
+def referenced(name):
+    return Recipe.objects.filter(image=name).exists()
+
+
+def delete_unused(name, variants):
+    """
+    Удаляет файл картинки и её копии без ссылок на них.
+    Имена файлов заданы содержимым, поэтому ту же картинку
+    может одновременно получить другой рецепт. Файлы сначала
+    переносятся в сторону, и если после этого на картинку
+    появилась ссылка, возвращаются на место; ссылку, появившуюся
+    позже, обработка того рецепта проверит сама (см. process).
+    """
+    if not name or referenced(name):
+        return
+    paths = [Recipe._meta.get_field('image').storage.path(name)] + [
+        thumbnails.storage.path(variant)
+        for items in variants.values() for _, variant in items
+    ]
+    moved = []
+    for path in paths:
+        trash = f'{path}.{uuid.uuid4().hex}.deleted'
+        try:
+            os.rename(path, trash)
+        except FileNotFoundError:
+            continue
+        moved.append((trash, path))
+    if referenced(name):
+        for trash, path in moved:
+            os.replace(trash, path)
+    else:
+        for trash, _ in moved:
+            os.remove(trash)
+
+
+def store(content, format):
+    """Сохраняет пересжатую картинку и возвращает её имя."""
+    field = Recipe._meta.get_field('image')
+    return field.storage.save(
+        field.generate_filename(
+            None, f'image.{thumbnails.EXTENSIONS[format]}'),
+        ContentFile(content))
+
+
+def finish(recipe_id, source, **fields):
+    """
+    Сохраняет результат, если картинку рецепта
+    за время обработки не заменили.
+    """
+    updated = Recipe.objects.filter(
+        id=recipe_id, image_upload=source
+    ).update(image_upload='', **fields)
+    if updated:
+        recipe_fragments.invalidate([recipe_id])
+        touch(RECIPES)
+    return updated
+
+
+def process(recipe_id, source):
+    """
+    Обрабатывает загрузку source и удаляет её: в общее
+    хранилище попадает только пересжатая картинка.
+    """
+    try:
+        with upload_storage.open(source) as file, Image.open(file) as image:
+            image.load()
+            image, format = prepare(image)
+    except (OSError, SyntaxError, ValueError,
+            Image.DecompressionBombError) as error:
+        logger.warning('Картинка %s рецепта %s отклонена: %s',
+                       source, recipe_id, error)
+        finish(recipe_id, source, image='', image_variants={},
+               image_status=Recipe.IMAGE_FAILED)
+        upload_storage.delete(source)
+        return
+    content = thumbnails.encode(image, format)
+    variants = thumbnails.generate(image, content, format)
+    name = store(content, format)
+    if finish(recipe_id, source, image=name, image_variants=variants,
+              image_status=Recipe.IMAGE_READY):
+        # Рецепт с той же картинкой мог удалить её файлы,
+        # пока ссылка на неё ещё не была зафиксирована.
+        store(content, format)
+        thumbnails.generate(image, content, format)
+    else:
+        release(name, variants)
+    upload_storage.delete(source)
+
+
+def add_variants(recipe_id, source):
+    """Копии для картинки, обработанной до их появления."""
+    storage = Recipe._meta.get_field('image').storage
+    with storage.open(source) as file:
+        content = file.read()
+    with Image.open(io.BytesIO(content)) as image:
+        image.load()
+        image, format = prepare(image)
+    variants = thumbnails.generate(image, content, format)
+    if Recipe.objects.filter(id=recipe_id, image=source).update(
+        image_variants=variants
+    ):
+        recipe_fragments.invalidate([recipe_id])
+        touch(RECIPES)
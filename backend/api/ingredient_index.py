@@ -0,0 +1,157 @@
+"""
+Индекс ингредиентов в памяти процесса для автодополнения.
+Таблица небольшая и почти не меняется, поэтому поиск
+по началу названия выполняется без обращения к базе.
+"""
+import bisect
+import threading
+from collections import Counter, defaultdict
+
+from django.core.cache import cache
+from django.db import transaction
+
+from recipes.models import Ingredient
+
+VERSION_KEY = 'ingredient_index:version'
+# Доля триграмм запроса, которая должна найтись в названии.
+FUZZY_THRESHOLD = 0.5
+FUZZY_LIMIT = 20
+
+
+def normalize(value):
+    """Приводит строку к виду для сравнения без учёта регистра и «ё»."""
+    return value.strip().casefold().replace('ё', 'е')
+
+
+def trigrams(value):
+    """Триграммы слов строки, как в pg_trgm: слово дополняется пробелами."""
+    result = set()
+    for word in value.split():
+        word = f'  {word} '
+        result.update(word[i:i + 3] for i in range(len(word) - 2))
+    return result
+
+
+def invalidate():
+    """
+    Помечает индексы всех процессов как устаревшие после фиксации
+    транзакции: иначе параллельный запрос перестроил бы индекс
+    по ещё не изменённой таблице и запомнил новую версию.
+    """
+    transaction.on_commit(next_version)
+
+
+def next_version():
+    if not cache.add(VERSION_KEY, 1, timeout=None):
+        cache.incr(VERSION_KEY)
+
+
+class IngredientIndex:
+    """Отсортированный по нормализованному названию список ингредиентов."""
+
+    def __init__(self):
+        self.keys = []
+        self.rows = []
+        self.by_id = {}
+        self.trigrams = {}
+        self.sizes = []
+        self.version = None
+        self.lock = threading.Lock()
+
+    def build(self):
+        rows = sorted(
+            Ingredient.objects.values('id', 'name', 'measurement_unit'),
+            key=lambda row: (normalize(row['name']), row['id'])
+        )
+        keys = [normalize(row['name']) for row in rows]
+        index = defaultdict(list)
+        sizes = []
+        for position, key in enumerate(keys):
+            key_trigrams = trigrams(key)
+            sizes.append(len(key_trigrams))
+            for trigram in key_trigrams:
+                index[trigram].append(position)
+        self.keys = keys
+        self.rows = rows
+        self.by_id = {row['id']: row for row in rows}
+        self.trigrams = dict(index)
+        self.sizes = sizes
+
+    def refresh(self):
+        """Перестраивает индекс, если ингредиенты менялись."""
+        version = cache.get(VERSION_KEY, 0)
+        if version == self.version:
+            return
+        with self.lock:
+            if version != self.version:
+                self.build()
+                self.version = version
+
+    def all(self):
+        self.refresh()
+        return self.rows
+
+    def get(self, ingredient_id):
+        self.refresh()
+        return self.by_id.get(ingredient_id)
+
+    def startswith(self, prefix):
+        """Ингредиенты, название которых начинается с prefix."""
+        self.refresh()
+        prefix = normalize(prefix)
+        if not prefix:
+            return self.rows
+        start = bisect.bisect_left(self.keys, prefix)
+        end = bisect.bisect_left(self.keys, prefix + chr(0x10FFFF), start)
+        return self.rows[start:end]
+
+    def search(self, query):
+        """
+        Ранжированный поиск: сначала совпадения по началу названия,
+        затем по вхождению, затем похожие по триграммам названия.
+        """
+        self.refresh()
+        query = normalize(query)
+        if not query:
+            return self.rows
+        start = bisect.bisect_left(self.keys, query)
+        end = bisect.bisect_left(self.keys, query + chr(0x10FFFF), start)
+        found = set(range(start, end))
+        contains = [
+            position for position in self.substring_candidates(query)
+            if position not in found and query in self.keys[position]
+        ]
+        found.update(contains)
+        query_trigrams = trigrams(query)
+        shared = Counter()
+        for trigram in query_trigrams:
+            shared.update(self.trigrams.get(trigram, ()))
+        minimum = FUZZY_THRESHOLD * len(query_trigrams)
+        fuzzy = sorted(
+            (-count, self.sizes[position], position)
+            for position, count in shared.items()
+            if count >= minimum and position not in found
+        )[:FUZZY_LIMIT]
+        return (
+            self.rows[start:end]
+            + [self.rows[position] for position in contains]
+            + [self.rows[position] for *_, position in fuzzy]
+        )
+
+    def substring_candidates(self, query):
+        """
+        Позиции названий, которые могут содержать query:
+        те, где есть все внутренние триграммы запроса.
+        """
+        inner = {query[i:i + 3] for i in range(len(query) - 2)}
+        if not inner or ' ' in query:
+            return range(len(self.keys))
+        postings = sorted((self.trigrams.get(trigram, ())
+                           for trigram in inner), key=len)
+        candidates = set(postings[0])
+        for positions in postings[1:]:
+            candidates.intersection_update(positions)
+        return sorted(candidates)
+
+
+ingredient_index = IngredientIndex()
@@ -0,0 +1,168 @@
+import time
+
+from django.contrib.auth.models import AnonymousUser
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+
+from api import recipe_rows
+from api.ingredient_index import ingredient_index, normalize
+from api.management import dataset
+from api.renderers import FastJSONRenderer
+from api.serializers import RecipeReadSerializer
+from recipes.models import Ingredient, Recipe
+from users.models import User
+
+RANKED_SEARCH_TARGET_MS = 5
+SERIALIZE_PAGE_SIZE = 50
+
+
+class Command(BaseCommand):
+    help = ('Сравнивает скорость оптимизированных путей с исходными '
+            'на тестовой базе с реалистичным набором данных.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('scenarios', nargs='*',
+                            help='Сценарии; по умолчанию все.')
+        dataset.add_arguments(parser)
+        parser.add_argument('--repeat', type=int, default=3)
+
+    def handle(self, *args, **options):
+        scenarios = {
+            'ingredients': self.bench_ingredients,
+            'ingredients_ranked': self.bench_ingredients_ranked,
+            'toggles': self.bench_toggles,
+            'serialize': self.bench_serialize,
+        }
+        names = options['scenarios'] or list(scenarios)
+        with dataset.test_database():
+            context = dataset.seed(options, self.stdout)
+            for name in names:
+                self.stdout.write(self.style.MIGRATE_HEADING(name))
+                scenarios[name](context, options)
+
+    def measure(self, label, func, items, repeat):
+        """Лучшее из repeat время прогона func по всем items."""
+        best = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            for item in items:
+                func(item)
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        self.stdout.write(
+            f'  {label:24} {best * 1000:9.1f} мс, '
+            f'{best / len(items) * 1e6:8.1f} мкс на операцию')
+        return best
+
+    def compare(self, baseline, optimized):
+        self.stdout.write(self.style.SUCCESS(
+            f'  ускорение в {baseline / optimized:.1f} раз'))
+
+    def bench_ingredients(self, context, options):
+        """Поиск ингредиентов по началу названия: ORM и индекс."""
+        prefixes = sorted({
+            normalize(name)[:length]
+            for name in Ingredient.objects.values_list('name', flat=True)
+            for length in (1, 2, 3)
+        })
+        self.stdout.write(f'  префиксов: {len(prefixes)}')
+        ingredient_index.refresh()
+        baseline = self.measure(
+            'ORM istartswith',
+            lambda prefix: list(Ingredient.objects.filter(
+                name__istartswith=prefix
+            ).values('id', 'name', 'measurement_unit')),
+            prefixes, options['repeat'])
+        optimized = self.measure(
+            'индекс в памяти', ingredient_index.startswith,
+            prefixes, options['repeat'])
+        self.compare(baseline, optimized)
+
+    def bench_ingredients_ranked(self, context, options):
+        """Ранжированный поиск ингредиентов: задержка на запрос."""
+        names = list(Ingredient.objects.values_list('name', flat=True))
+        queries = [name[:length] for name in names[::5]
+                   for length in (1, 3, 6)]
+        queries += ['сахр', 'молако', 'помидры', 'ябоко', 'зелёный лук']
+        ingredient_index.refresh()
+        timings = []
+        for query in queries:
+            start = time.perf_counter()
+            ingredient_index.search(query)
+            timings.append((time.perf_counter() - start) * 1000)
+        worst = max(timings)
+        style = (self.style.SUCCESS if worst < RANKED_SEARCH_TARGET_MS
+                 else self.style.ERROR)
+        self.stdout.write(style(
+            f'  запросов: {len(queries)}, в среднем '
+            f'{sum(timings) / len(timings):.2f} мс, худший {worst:.2f} мс '
+            f'(цель {RANKED_SEARCH_TARGET_MS} мс)'))
+
+    def bench_toggles(self, context, options):
+        """Избранное, список покупок и подписка: запросы и время."""
+        user = context['user']
+        client = APIClient()
+        client.force_authenticate(user)
+        recipes = list(Recipe.objects.exclude(
+            favorites_recipes__user=user
+        ).exclude(
+            recipe_shopping_cart__user=user
+        ).values_list('id', flat=True)[:200])
+        authors = list(User.objects.exclude(
+            subscribing__user=user
+        ).exclude(id=user.id).values_list('id', flat=True)[:200])
+        for label, url, ids in (
+            ('избранное', '/api/recipes/{}/favorite/', recipes),
+            ('список покупок', '/api/recipes/{}/shopping_cart/', recipes),
+            ('подписка', '/api/users/{}/subscribe/', authors),
+        ):
+            for method in ('post', 'delete'):
+                with CaptureQueriesContext(connection) as queries:
+                    start = time.perf_counter()
+                    for pk in ids:
+                        getattr(client, method)(url.format(pk))
+                    elapsed = time.perf_counter() - start
+                writes = sum(
+                    not query['sql'].startswith(('SELECT', 'BEGIN'))
+                    for query in queries
+                )
+                self.stdout.write(
+                    f'  {label:15} {method.upper():6} '
+                    f'запросов {len(queries) / len(ids):.1f}, '
+                    f'из них записей {writes / len(ids):.1f}, '
+                    f'{elapsed / len(ids) * 1000:.2f} мс')
+
+    def bench_serialize(self, context, options):
+        """
+        Сериализация рецептов без кеша фрагментов: поля
+        ModelSerializer и JSONRenderer против строк values()
+        и FastJSONRenderer. Страницы по SERIALIZE_PAGE_SIZE.
+        """
+        ids = list(Recipe.objects.values_list('id', flat=True))
+        pages = [ids[start:start + SERIALIZE_PAGE_SIZE]
+                 for start in range(0, len(ids), SERIALIZE_PAGE_SIZE)]
+        serializer = RecipeReadSerializer()
+        baseline_renderer = JSONRenderer()
+        optimized_renderer = FastJSONRenderer()
+
+        def baseline(page):
+            recipes = Recipe.objects.with_relations(
+                AnonymousUser()).filter(id__in=page)
+            baseline_renderer.render(
+                [serializer.fragment(recipe) for recipe in recipes])
+
+        def optimized(page):
+            optimized_renderer.render(
+                list(recipe_rows.build_fragments(page).values()))
+
+        results = []
+        for label, func in (('ModelSerializer + DRF', baseline),
+                            ('values() + FastJSON', optimized)):
+            elapsed = self.measure(label, func, pages, options['repeat'])
+            results.append(elapsed)
+            self.stdout.write(
+                f'  {"":24} {len(ids) / elapsed:9.0f} рецептов в секунду')
+        self.compare(*results)
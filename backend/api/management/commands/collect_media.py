@@ -0,0 +1,83 @@
+import os
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from api import images
+from recipes.models import Recipe
+
+MEDIA_DIR = 'recipes'
+
+
+class Command(BaseCommand):
+    help = ('Удаляет картинки рецептов, их копии и необработанные '
+            'загрузки, на которые не ссылается ни один рецепт.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--min-age', type=int, default=60,
+            help='Не трогать файлы моложе стольких минут: '
+                 'они могут принадлежать незавершённой загрузке.')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Только показать, что будет удалено.')
+
+    def walk(self, storage, directory):
+        directories, files = storage.listdir(directory)
+        for name in files:
+            yield os.path.join(directory, name)
+        for name in directories:
+            yield from self.walk(storage, os.path.join(directory, name))
+
+    def referenced(self):
+        names = set()
+        for image, variants in Recipe.objects.exclude(
+            image=''
+        ).values_list('image', 'image_variants').iterator():
+            names.add(image)
+            for items in variants.values():
+                names.update(variant for _, variant in items)
+        return names
+
+    def uploads(self):
+        return set(Recipe.objects.exclude(
+            image_upload=''
+        ).values_list('image_upload', flat=True))
+
+    def collect(self, storage, referenced, threshold, dry_run):
+        """
+        Удаляет файлы storage старше threshold, которых нет среди
+        referenced(). Ссылки читаются после списка файлов: файл,
+        сохранённый между ними, не будет удалён.
+        """
+        if not storage.exists(MEDIA_DIR):
+            return 0, 0
+        files = list(self.walk(storage, MEDIA_DIR))
+        referenced = referenced()
+        removed = size = 0
+        for name in files:
+            if (name in referenced
+                    or storage.get_modified_time(name) > threshold):
+                continue
+            size += storage.size(name)
+            removed += 1
+            if dry_run:
+                self.stdout.write(name)
+            else:
+                storage.delete(name)
+        return removed, size
+
+    def handle(self, *args, **options):
+        threshold = timezone.now() - timedelta(minutes=options['min_age'])
+        removed = size = 0
+        for storage, referenced in (
+            (Recipe._meta.get_field('image').storage, self.referenced),
+            (images.upload_storage, self.uploads),
+        ):
+            collected = self.collect(storage, referenced, threshold,
+                                     options['dry_run'])
+            removed += collected[0]
+            size += collected[1]
+        action = 'Будет удалено' if options['dry_run'] else 'Удалено'
+        self.stdout.write(
+            f'{action} файлов: {removed}, {size / 2 ** 20:.1f} МБ')
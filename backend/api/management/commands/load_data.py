@@ -0,0 +1,116 @@
+import csv
+import json
+import time
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from api import ingredient_index, tag_registry
+from api.conditional import INGREDIENTS, TAGS, touch
+from recipes.models import Ingredient, Tag
+
+CHUNK_SIZE = 64 * 1024
+JSON_SEPARATORS = ' \t\r\n,'
+LOCAL_CACHE = 'django.core.cache.backends.locmem.LocMemCache'
+
+
+def iter_json_array(file):
+    """Читает элементы JSON-массива по одному, не загружая файл целиком."""
+    decoder = json.JSONDecoder()
+    buffer = file.read(CHUNK_SIZE).lstrip()
+    if not buffer.startswith('['):
+        raise CommandError(f'{file.name}: ожидается JSON-массив.')
+    buffer = buffer[1:]
+    while True:
+        buffer = buffer.lstrip(JSON_SEPARATORS)
+        if buffer.startswith(']'):
+            return
+        try:
+            item, end = decoder.raw_decode(buffer)
+        except json.JSONDecodeError:
+            chunk = file.read(CHUNK_SIZE)
+            if not chunk:
+                raise CommandError(f'{file.name}: некорректный JSON.')
+            buffer += chunk
+            continue
+        yield item
+        buffer = buffer[end:]
+
+
+def read_rows(path, fields):
+    """Строки CSV (без заголовка, поля по порядку) или объекты JSON."""
+    path = Path(path)
+    with open(path, encoding='utf-8') as file:
+        if path.suffix == '.csv':
+            for row in csv.reader(file):
+                yield dict(zip(fields, row))
+        elif path.suffix == '.json':
+            for item in iter_json_array(file):
+                yield {field: item[field] for field in fields}
+        else:
+            raise CommandError(f'{path}: поддерживаются только CSV и JSON.')
+
+
+class Command(BaseCommand):
+    help = ('Загружает ингредиенты и теги из CSV или JSON. '
+            'Уже существующие записи пропускаются.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--ingredients',
+                            default=settings.BASE_DIR / 'ingredients.json')
+        parser.add_argument('--tags', default=settings.BASE_DIR / 'tags.json')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        with transaction.atomic():
+            ingredients = self.load(
+                Ingredient, options['ingredients'],
+                ('name', 'measurement_unit'), ('name', 'measurement_unit'),
+                options['batch_size'])
+            tags = self.load(
+                Tag, options['tags'],
+                ('name', 'color', 'slug'), ('slug',),
+                options['batch_size'])
+        ingredient_index.invalidate()
+        tag_registry.invalidate()
+        touch(INGREDIENTS, TAGS)
+        elapsed = time.perf_counter() - start
+        total = ingredients + tags
+        self.stdout.write(self.style.SUCCESS(
+            f'Обработано строк: {total} за {elapsed:.2f} с '
+            f'({total / elapsed:.0f} строк/с).'))
+        if settings.CACHES['default']['BACKEND'] == LOCAL_CACHE:
+            # Кеш в памяти у каждого процесса свой: запущенный
+            # сервер не узнает об изменении справочников.
+            self.stdout.write(self.style.WARNING(
+                'Кеш не общий с сервером (CACHE_BACKEND): '
+                'перезапустите backend, чтобы он увидел новые данные.'))
+
+    def load(self, model, path, fields, key_fields, batch_size):
+        """
+        Загружает записи пачками, пропуская повторы
+        в файле и уже существующие в базе записи.
+        """
+        seen = set(model.objects.values_list(*key_fields))
+        batch = []
+        rows = created = 0
+        for row in read_rows(path, fields):
+            rows += 1
+            key = tuple(row[field] for field in key_fields)
+            if key in seen:
+                continue
+            seen.add(key)
+            batch.append(model(**row))
+            if len(batch) >= batch_size:
+                model.objects.bulk_create(batch, ignore_conflicts=True)
+                created += len(batch)
+                batch = []
+        model.objects.bulk_create(batch, ignore_conflicts=True)
+        created += len(batch)
+        self.stdout.write(
+            f'{model._meta.verbose_name_plural}: строк {rows}, '
+            f'добавлено {created}.')
+        return rows
@@ -0,0 +1,49 @@
+from django.core.management.base import BaseCommand
+
+from api import images
+from recipes.models import Recipe
+
+
+class Command(BaseCommand):
+    help = ('Обрабатывает картинки рецептов, оставшиеся в очереди, '
+            'например после перезапуска сервера.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--variants', action='store_true',
+            help='Создать уменьшенные копии для картинок, '
+                 'обработанных до их появления.')
+
+    def hide_public_upload(self, recipe_id, name):
+        """
+        Загрузку, сохранённую до появления закрытого
+        хранилища в общем, переносит в закрытое.
+        """
+        storage = Recipe._meta.get_field('image').storage
+        with storage.open(name) as file:
+            upload = images.store_upload(file)
+        Recipe.objects.filter(id=recipe_id).update(image='',
+                                                   image_upload=upload)
+        images.delete_unused(name, {})
+        return upload
+
+    def handle(self, *args, **options):
+        pending = Recipe.objects.filter(
+            image_status=Recipe.IMAGE_PROCESSING
+        ).values_list('id', 'image', 'image_upload')
+        for recipe_id, image, upload in pending:
+            if not upload and image:
+                upload = self.hide_public_upload(recipe_id, image)
+            images.process(recipe_id, upload)
+        self.stdout.write(f'Обработано картинок: {len(pending)}')
+        if not options['variants']:
+            return
+        missing = Recipe.objects.filter(
+            image_status=Recipe.IMAGE_READY, image_variants={}
+        ).exclude(image='').values_list('id', 'image')
+        for recipe_id, image in missing:
+            try:
+                images.add_variants(recipe_id, image)
+            except (OSError, SyntaxError, ValueError) as error:
+                self.stderr.write(f'{image}: {error}')
+        self.stdout.write(f'Созданы копии для картинок: {len(missing)}')
@@ -0,0 +1,199 @@
+import statistics
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+
+from api.management import dataset
+
+# Бюджеты эндпоинтов: название, метод, адрес, максимум
+# SQL-запросов, максимум для GET на холодном кеше
+# (None для изменяющих запросов), максимум миллисекунд.
+# Избранное и подписки дополнительно обновляют счётчик
+# в той же транзакции. Вставка связи идёт в точке сохранения
+# (SAVEPOINT и RELEASE учитываются как запросы).
+BUDGETS = (
+    ('recipes-list', 'get', '/api/recipes/', 1, 5, 100),
+    ('recipes-list-50', 'get', '/api/recipes/?limit=50', 1, 5, 250),
+    ('recipes-list-filtered', 'get',
+     '/api/recipes/?tags=breakfast&tags=lunch&is_favorited=1', 1, 5, 250),
+    ('recipes-list-anonymous', 'get', '/api/recipes/', 0, 5, 250),
+    ('recipes-list-cursor', 'get', '/api/recipes/?cursor=&limit=50',
+     1, 4, 250),
+    ('recipes-detail', 'get', '/api/recipes/{recipe}/', 1, 4, 100),
+    ('recipes-create-50', 'post', '/api/recipes/', 10, None, 300),
+    ('recipes-update', 'patch', '/api/recipes/{own_recipe}/',
+     9, None, 100),
+    ('recipes-delete', 'delete', '/api/recipes/{own_recipe}/',
+     12, None, 100),
+    ('recipes-favorite-post', 'post', '/api/recipes/{recipe}/favorite/',
+     6, None, 50),
+    ('recipes-favorite-delete', 'delete',
+     '/api/recipes/{recipe}/favorite/', 3, None, 50),
+    ('recipes-cart-post', 'post', '/api/recipes/{recipe}/shopping_cart/',
+     3, None, 50),
+    ('recipes-cart-delete', 'delete',
+     '/api/recipes/{recipe}/shopping_cart/', 2, None, 50),
+    ('recipes-download-cart', 'get',
+     '/api/recipes/download_shopping_cart/', 3, 1, 1000),
+    ('recipes-download-cart-csv', 'get',
+     '/api/recipes/download_shopping_cart/?format=csv', 3, 1, 100),
+    ('recipes-download-cart-json', 'get',
+     '/api/recipes/download_shopping_cart/?format=json', 3, 1, 100),
+    ('users-list', 'get', '/api/users/', 10, 8, 150),
+    ('users-detail', 'get', '/api/users/{author}/', 4, 2, 100),
+    ('users-me', 'get', '/api/users/me/', 3, 1, 100),
+    ('users-subscriptions', 'get', '/api/users/subscriptions/', 3, 3, 100),
+    ('users-subscriptions-limit', 'get',
+     '/api/users/subscriptions/?recipes_limit=3', 3, 3, 100),
+    ('users-subscriptions-50', 'get',
+     '/api/users/subscriptions/?limit=50&recipes_limit=3', 3, 3, 150),
+    ('users-subscriptions-cursor', 'get',
+     '/api/users/subscriptions/?cursor=&limit=50&recipes_limit=3', 2, 2, 150),
+    ('users-subscribe-post', 'post', '/api/users/{author}/subscribe/',
+     7, None, 100),
+    ('users-subscribe-delete', 'delete', '/api/users/{author}/subscribe/',
+     3, None, 50),
+    ('users-create', 'post', '/api/users/', 3, None, 500),
+    ('auth-token-login', 'post', '/api/auth/token/login/',
+     5, None, 500),
+    ('auth-token-logout', 'post', '/api/auth/token/logout/',
+     2, None, 50),
+    ('users-set-password', 'post', '/api/users/set_password/',
+     2, None, 1000),
+    ('ingredients-list', 'get', '/api/ingredients/', 0, 1, 300),
+    ('ingredients-search', 'get', '/api/ingredients/?name=са', 0, 1, 20),
+    ('ingredients-search-ranked', 'get',
+     '/api/ingredients/?name=сахр&mode=ranked', 0, 1, 20),
+    ('ingredients-detail', 'get', '/api/ingredients/{ingredient}/', 0, 1, 50),
+    ('tags-list', 'get', '/api/tags/', 0, 1, 50),
+    ('tags-detail', 'get', '/api/tags/{tag}/', 0, 1, 50),
+)
+
+ANONYMOUS = ('recipes-list-anonymous', 'users-create', 'auth-token-login')
+
+
+def recipe_payload(context):
+    """Рецепт с 50 ингредиентами: id проверяются одним запросом."""
+    return {
+        'ingredients': [{'id': pk, 'amount': 10}
+                        for pk in context['ingredients'][:50]],
+        'tags': context['tags'][:2],
+        'name': 'Рецепт',
+        'text': 'Текст рецепта',
+        'cooking_time': 10,
+    }
+
+
+def user_payload(context):
+    return {
+        'email': 'new-user@foodgram.ru',
+        'username': 'new-user',
+        'first_name': 'Имя',
+        'last_name': 'Фамилия',
+        'password': 'new-user-password',
+    }
+
+
+def login_payload(context):
+    return {'email': context['user'].email, 'password': dataset.PASSWORD}
+
+
+def password_payload(context):
+    return {'current_password': dataset.PASSWORD,
+            'new_password': 'new-budget-password'}
+
+
+# Тела запросов по названию бюджета.
+PAYLOADS = {
+    'recipes-create-50': recipe_payload,
+    'recipes-update': lambda context: {'name': 'Новое название',
+                                       'cooking_time': 15},
+    'users-create': user_payload,
+    'auth-token-login': login_payload,
+    'users-set-password': password_payload,
+}
+
+
+class Command(BaseCommand):
+    help = ('Проверяет число SQL-запросов и время ответа эндпоинтов API '
+            'на тестовой базе с реалистичным набором данных.')
+
+    def add_arguments(self, parser):
+        dataset.add_arguments(parser)
+        parser.add_argument('--repeat', type=int, default=5,
+                            help='Число замеров для GET-запросов.')
+        parser.add_argument('--no-time', action='store_true',
+                            help='Не проверять время ответа.')
+
+    def handle(self, *args, **options):
+        with dataset.test_database():
+            context = dataset.seed(options, self.stdout)
+            failures = self.check_budgets(context, options)
+        if failures:
+            raise CommandError(
+                'Превышен бюджет: ' + ', '.join(failures))
+        self.stdout.write(self.style.SUCCESS('Все бюджеты соблюдены.'))
+
+    @staticmethod
+    def send(api, method, url, data):
+        response = getattr(api, method)(url, **data)
+        if response.streaming:
+            b''.join(response.streaming_content)
+        return response
+
+    def check_budgets(self, context, options):
+        """
+        Выполняет запросы и сравнивает их с бюджетами. GET
+        сначала выполняется на пустых кешах, затем замеряется
+        с заполненными.
+        """
+        client = APIClient()
+        client.force_authenticate(context['user'])
+        anonymous = APIClient()
+        failures = []
+        for name, method, url, max_queries, max_cold, max_ms in BUDGETS:
+            url = url.format(**context['urls'])
+            api = anonymous if name in ANONYMOUS else client
+            repeat = options['repeat'] if method == 'get' else 1
+            payload = PAYLOADS.get(name)
+            data = (
+                {'data': payload(context), 'format': 'json'}
+                if payload else {}
+            )
+            if method == 'get':
+                dataset.clear_caches()
+                with CaptureQueriesContext(connection) as queries:
+                    response = self.send(api, method, url, data)
+                self.report(f'{name} (cold)', response, queries, max_cold)
+                if response.status_code >= 400 or len(queries) > max_cold:
+                    failures.append(f'{name} (cold)')
+            timings = []
+            for _ in range(repeat):
+                with CaptureQueriesContext(connection) as queries:
+                    start = time.perf_counter()
+                    response = self.send(api, method, url, data)
+                    timings.append((time.perf_counter() - start) * 1000)
+            elapsed = statistics.median(timings)
+            failed = (
+                response.status_code >= 400
+                or len(queries) > max_queries
+                or (not options['no_time'] and elapsed > max_ms)
+            )
+            if failed:
+                failures.append(name)
+            self.report(name, response, queries, max_queries,
+                        f'{elapsed:7.1f}/{max_ms} мс', failed)
+        return failures
+
+    def report(self, name, response, queries, max_queries, timing='',
+               failed=None):
+        if failed is None:
+            failed = (response.status_code >= 400
+                      or len(queries) > max_queries)
+        style = self.style.ERROR if failed else self.style.SUCCESS
+        self.stdout.write(style(
+            f'{name:35} {response.status_code} '
+            f'запросов {len(queries):3}/{max_queries:<3} {timing}'))
@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from api.shopping_list import cache_stats
+
+
+class Command(BaseCommand):
+    help = ('Показывает счётчики попаданий и промахов кеша списков покупок. '
+            'Имеет смысл при общем для воркеров бэкенде кеша.')
+
+    def handle(self, *args, **options):
+        for name, value in cache_stats().items():
+            self.stdout.write(f'{name}: {value}')
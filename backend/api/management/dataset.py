@@ -0,0 +1,138 @@
+"""Тестовая база с реалистичным набором данных для замеров."""
+import csv
+import json
+import random
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.management.color import no_style
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from api.ingredient_index import ingredient_index
+from api.tag_registry import tag_registry
+from recipes import counters
+from recipes.models import (Ingredient,
+                            Tag,
+                            Recipe,
+                            Favorite,
+                            ShoppingCart,
+                            Subscribe,
+                            IngredientAmount)
+from users.models import User
+
+# Пароль основного пользователя для входа по токену.
+PASSWORD = 'foodgram-budget-password'
+
+
+def add_arguments(parser):
+    parser.add_argument('--recipes', type=int, default=3000)
+    parser.add_argument('--users', type=int, default=300)
+    parser.add_argument(
+        '--ingredients',
+        default=settings.BASE_DIR.parent / 'data' / 'ingredients.csv',
+        help='CSV-файл с ингредиентами (название, единица измерения).'
+    )
+
+
+@contextmanager
+def test_database():
+    """Временная тестовая база, удаляемая после замеров."""
+    setup_test_environment()
+    old_name = connection.creation.create_test_db(
+        verbosity=0, autoclobber=True)
+    try:
+        yield
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        teardown_test_environment()
+
+
+def clear_caches():
+    """
+    Холодный старт: пустые кеши и непрочитанные
+    теги и ингредиенты в памяти процесса.
+    """
+    for cache in caches.all():
+        cache.clear()
+    tag_registry.version = None
+    ingredient_index.version = None
+
+
+def seed(options, stdout):
+    """
+    Наполняет тестовую базу данными. Возвращает основного
+    пользователя и идентификаторы объектов для адресов API.
+    """
+    rnd = random.Random(0)
+    with open(settings.BASE_DIR / 'tags.json', encoding='utf-8') as file:
+        tags = Tag.objects.bulk_create(
+            Tag(id=pk, **tag)
+            for pk, tag in enumerate(json.load(file), start=1))
+    with open(options['ingredients'], encoding='utf-8') as file:
+        ingredients = Ingredient.objects.bulk_create(
+            Ingredient(id=pk, name=name, measurement_unit=unit)
+            for pk, (name, unit) in enumerate(csv.reader(file), start=1))
+    users = [
+        User(id=pk, email=f'user{pk}@foodgram.ru',
+             username=f'user{pk}', first_name='Имя',
+             last_name='Фамилия')
+        for pk in range(1, options['users'] + 1)
+    ]
+    for user in users[1:]:
+        user.set_unusable_password()
+    users[0].set_password(PASSWORD)
+    User.objects.bulk_create(users)
+    recipes = Recipe.objects.bulk_create(
+        Recipe(id=pk, author=rnd.choice(users), name=f'Рецепт {pk}',
+               text='Текст рецепта', cooking_time=rnd.randint(1, 120))
+        for pk in range(1, options['recipes'] + 1))
+    # Строки вставлены с явными id: последовательности PostgreSQL
+    # сдвигаются, чтобы новые объекты API не получили занятые id.
+    with connection.cursor() as cursor:
+        for sql in connection.ops.sequence_reset_sql(
+                no_style(), [Tag, Ingredient, User, Recipe]):
+            cursor.execute(sql)
+    Recipe.tags.through.objects.bulk_create(
+        Recipe.tags.through(recipe_id=recipe.id, tag_id=tag.id)
+        for recipe in recipes
+        for tag in rnd.sample(tags, rnd.randint(1, 3)))
+    IngredientAmount.objects.bulk_create(
+        IngredientAmount(recipe=recipe, ingredient=ingredient,
+                         amount=rnd.randint(1, 500))
+        for recipe in recipes
+        for ingredient in rnd.sample(ingredients, rnd.randint(3, 12)))
+
+    user, author = users[0], users[-1]
+    followed = [other for other in users[1:-1] if rnd.random() < 0.2]
+    Subscribe.objects.bulk_create(
+        Subscribe(user=user, author=other) for other in followed)
+    recipe = next(recipe for recipe in recipes
+                  if recipe.author_id != user.id)
+    own_recipe = next(recipe for recipe in recipes
+                      if recipe.author_id == user.id)
+    others = [other for other in recipes if other is not recipe]
+    Favorite.objects.bulk_create(
+        Favorite(user=user, recipe=other)
+        for other in rnd.sample(others, len(others) // 10))
+    ShoppingCart.objects.bulk_create(
+        ShoppingCart(user=user, recipe=other)
+        for other in rnd.sample(others, 25))
+    counters.recount()
+    stdout.write(
+        f'Данные: рецептов {len(recipes)}, ингредиентов '
+        f'{len(ingredients)}, пользователей {len(users)}, '
+        f'подписок {len(followed)}.')
+    return {
+        'user': user,
+        'ingredients': [ingredient.id for ingredient in ingredients],
+        'tags': [tag.id for tag in tags],
+        'urls': {
+            'recipe': recipe.id,
+            'own_recipe': own_recipe.id,
+            'author': author.id,
+            'ingredient': ingredients[len(ingredients) // 2].id,
+            'tag': tags[0].id,
+        },
+    }
@@ -1,7 +1,133 @@
+import base64
+import binascii
+import json
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
 from rest_framework.pagination import PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+from api import recipe_counts
 
 
 class RecipePagination(PageNumberPagination):
-    """Паджинация рецептов."""
+    """Паджинация рецептов.
+       По умолчанию постраничная (page, limit). С параметром
+       cursor (для первой страницы пустым) выдача идёт по ключу
+       сортировки view.cursor_ordering: без OFFSET и COUNT,
+       и новые записи не сдвигают уже просмотренные страницы."""
     page_size = 6
     page_size_query_param = 'limit'
+    cursor_query_param = 'cursor'
+    cursor_ordering = ('-pub_date', '-id')
+    invalid_cursor_message = 'Неверный курсор.'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.use_cursor = self.cursor_query_param in request.query_params
+        if not self.use_cursor:
+            self.count_options = self.get_count_options(request, view)
+            return super().paginate_queryset(queryset, request, view)
+        self.request = request
+        self.ordering = getattr(view, 'cursor_ordering',
+                                self.cursor_ordering)
+        self.fields = [queryset.model._meta.get_field(name.lstrip('-'))
+                       for name in self.ordering]
+        page_size = self.get_page_size(request)
+        position, reverse = self.decode_cursor(request)
+
+        ordering = self.ordering
+        if reverse:
+            ordering = [self.reverse_field(name) for name in ordering]
+        queryset = queryset.order_by(*ordering)
+        if position is not None:
+            queryset = queryset.filter(self.after(ordering, position))
+        results = list(queryset[:page_size + 1])
+        has_more = len(results) > page_size
+        results = results[:page_size]
+        if reverse:
+            results.reverse()
+            has_next, has_previous = True, has_more
+        else:
+            has_next, has_previous = has_more, position is not None
+        self.next_position = self.previous_position = None
+        if results and has_next:
+            self.next_position = self.get_position(results[-1])
+        if results and has_previous:
+            self.previous_position = self.get_position(results[0])
+        return results
+
+    @staticmethod
+    def get_count_options(request, view):
+        """
+        Число строк кешируется для view с cache_count
+        по набору фильтров, без фильтров может оцениваться.
+        """
+        if not getattr(view, 'cache_count', False):
+            return {}
+        filterset_class = getattr(view, 'filterset_class', None)
+        filters = recipe_counts.normalize_filters(
+            request,
+            filterset_class.base_filters if filterset_class else ()
+        )
+        return {
+            'cache_key': recipe_counts.cache_key(request, filters),
+            'estimated': not filters,
+        }
+
+    def django_paginator_class(self, queryset, page_size):
+        return recipe_counts.CachedCountPaginator(
+            queryset, page_size, **self.count_options)
+
+    @staticmethod
+    def reverse_field(name):
+        return name[1:] if name.startswith('-') else '-' + name
+
+    def after(self, ordering, position):
+        """Условие «строго после position» в порядке ordering."""
+        condition = Q()
+        for index, name in enumerate(ordering):
+            lookup = 'lt' if name.startswith('-') else 'gt'
+            equal = {field.name: value for field, value
+                     in zip(self.fields[:index], position[:index])}
+            condition |= Q(**equal, **{
+                f'{name.lstrip("-")}__{lookup}': position[index]})
+        return condition
+
+    def get_position(self, obj):
+        return [field.value_to_string(obj) for field in self.fields]
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None, False
+        try:
+            data = json.loads(base64.urlsafe_b64decode(encoded.encode()))
+            if len(data['p']) != len(self.fields):
+                raise ValueError
+            position = [field.to_python(value) for field, value
+                        in zip(self.fields, data['p'])]
+            return position, bool(data['r'])
+        except (binascii.Error, KeyError, TypeError, ValueError,
+                ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def encode_cursor(self, position, reverse):
+        if position is None:
+            return None
+        data = json.dumps({'p': position, 'r': int(reverse)})
+        url = self.request.build_absolute_uri()
+        url = remove_query_param(url, self.page_query_param)
+        return replace_query_param(
+            url, self.cursor_query_param,
+            base64.urlsafe_b64encode(data.encode()).decode())
+
+    def get_paginated_response(self, data):
+        if not self.use_cursor:
+            return super().get_paginated_response(data)
+        return Response({
+            'next': self.encode_cursor(self.next_position, False),
+            'previous': self.encode_cursor(self.previous_position, True),
+            'results': data,
+        })
@@ -0,0 +1,101 @@
+"""Число рецептов для постраничной выдачи: из кеша или из статистики."""
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.paginator import Paginator
+from django.db import connection, transaction
+from django.utils.functional import cached_property
+
+CACHE_PREFIX = 'recipe_count'
+VERSION_KEY = f'{CACHE_PREFIX}:version'
+# Фильтры, результат которых зависит от пользователя.
+USER_FILTERS = ('is_favorited', 'is_in_shopping_cart')
+
+
+def version_key(user_id=None):
+    return f'{VERSION_KEY}:{"all" if user_id is None else user_id}'
+
+
+def invalidate(user_id=None):
+    """
+    Сбрасывает закешированные числа: все или только
+    по фильтрам избранного и списка покупок пользователя.
+    Версия меняется после фиксации транзакции.
+    """
+    key = version_key(user_id)
+    transaction.on_commit(lambda: next_version(key))
+
+
+def next_version(key):
+    if not cache.add(key, 1, timeout=None):
+        cache.incr(key)
+
+
+def normalize_filters(request, filter_names):
+    """
+    Значения известных фильтров в постоянном порядке.
+    Фильтры по пользователю учитываются, только если применяются.
+    """
+    params = request.query_params
+    filters = []
+    for name in sorted(filter_names):
+        values = sorted(params.getlist(name))
+        if name in USER_FILTERS and (
+                values != ['1'] or not request.user.is_authenticated):
+            continue
+        if values:
+            filters.append((name, values))
+    return filters
+
+
+def cache_key(request, filters):
+    scopes = [None]
+    if any(name in USER_FILTERS for name, _ in filters):
+        scopes.append(request.user.id)
+    versions = cache.get_many([version_key(scope) for scope in scopes])
+    state = [(scope, versions.get(version_key(scope), 0))
+             for scope in scopes]
+    digest = hashlib.md5(repr((state, filters)).encode()).hexdigest()
+    return f'{CACHE_PREFIX}:{digest}'
+
+
+def estimate(model):
+    """
+    Число строк по статистике планировщика PostgreSQL.
+    None, если оценки нет или таблица меньше порога.
+    """
+    if connection.vendor != 'postgresql':
+        return None
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT reltuples FROM pg_class '
+                       'WHERE oid = %s::regclass', [model._meta.db_table])
+        row = cursor.fetchone()
+    if row is None or row[0] < settings.RECIPE_COUNT_ESTIMATE_MIN:
+        return None
+    return int(row[0])
+
+
+class CachedCountPaginator(Paginator):
+    """Паджинатор, который не считает строки на каждой странице."""
+
+    def __init__(self, object_list, per_page, cache_key=None,
+                 estimated=False, **kwargs):
+        super().__init__(object_list, per_page, **kwargs)
+        self.cache_key = cache_key
+        self.estimated = estimated
+
+    @cached_property
+    def count(self):
+        if self.estimated:
+            count = estimate(self.object_list.model)
+            if count is not None:
+                return count
+        if self.cache_key is None:
+            return super().count
+        count = cache.get(self.cache_key)
+        if count is None:
+            count = super().count
+            cache.set(self.cache_key, count,
+                      settings.RECIPE_COUNT_CACHE_TIMEOUT)
+        return count
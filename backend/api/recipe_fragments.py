@@ -0,0 +1,71 @@
+"""
+Кеш не зависящей от пользователя части представления рецепта:
+теги, ингредиенты, автор, текст, картинка. Признаки избранного,
+списка покупок и подписки накладываются поверх при выдаче.
+В ключ фрагмента входят поколение кеша и версия рецепта,
+прочитанные до выборки из базы. Сброс после фиксации транзакции
+увеличивает версию, поэтому фрагмент, построенный параллельным
+запросом по старым данным, сохранится под уже устаревшим ключом.
+"""
+from django.core.cache import cache
+from django.db import transaction
+
+CACHE_PREFIX = 'recipe_fragment'
+GENERATION_KEY = f'{CACHE_PREFIX}:generation'
+# Сколько хранится фрагмент, к которому давно не обращались.
+TIMEOUT = 24 * 60 * 60
+
+
+def version_key(recipe_id):
+    return f'{CACHE_PREFIX}:version:{recipe_id}'
+
+
+def fragment_keys(recipe_ids):
+    """Ключи фрагментов по id рецептов с текущими поколением и версиями."""
+    versions = cache.get_many([GENERATION_KEY] + [
+        version_key(recipe_id) for recipe_id in recipe_ids])
+    generation = versions.get(GENERATION_KEY, 0)
+    return {
+        recipe_id: (f'{CACHE_PREFIX}:{generation}:{recipe_id}:'
+                    f'{versions.get(version_key(recipe_id), 0)}')
+        for recipe_id in recipe_ids
+    }
+
+
+def get_many(recipe_ids):
+    """Закешированные фрагменты рецептов по id и ключи для set_many."""
+    keys = fragment_keys(recipe_ids)
+    cached = cache.get_many(keys.values())
+    return {recipe_id: cached[key] for recipe_id, key in keys.items()
+            if key in cached}, keys
+
+
+def set_many(fragments, keys):
+    """Сохраняет фрагменты под ключами, полученными из get_many."""
+    cache.set_many({
+        keys[recipe_id]: fragment
+        for recipe_id, fragment in fragments.items()
+    }, timeout=TIMEOUT)
+
+
+def invalidate(recipe_ids):
+    """Фрагменты изменившихся рецептов устаревают."""
+    recipe_ids = list(recipe_ids)
+    transaction.on_commit(lambda: next_versions(recipe_ids))
+
+
+def next_versions(recipe_ids):
+    for recipe_id in recipe_ids:
+        key = version_key(recipe_id)
+        if not cache.add(key, 1, timeout=None):
+            cache.incr(key)
+
+
+def invalidate_all():
+    """Устаревают все фрагменты: изменились теги или ингредиенты."""
+    transaction.on_commit(next_generation)
+
+
+def next_generation():
+    if not cache.add(GENERATION_KEY, 1, timeout=None):
+        cache.incr(GENERATION_KEY)
@@ -0,0 +1,68 @@
+"""
+Представления рецептов из строк values() без механизма полей
+ModelSerializer. Результат совпадает с RecipeReadSerializer
+для анонимного пользователя с относительной ссылкой на картинку.
+"""
+from collections import defaultdict
+
+from api import thumbnails
+from api.tag_registry import tag_registry
+from recipes.models import IngredientAmount, Recipe
+
+AUTHOR_FIELDS = ('id', 'email', 'username', 'first_name', 'last_name')
+RECIPE_FIELDS = ('id', 'name', 'image', 'image_status', 'image_variants',
+                 'text', 'cooking_time', 'tag_ids')
+
+
+def ingredient_rows(recipe_ids):
+    """Ингредиенты рецептов в порядке добавления."""
+    rows = IngredientAmount.objects.filter(
+        recipe_id__in=recipe_ids
+    ).order_by('id').values_list(
+        'recipe_id', 'ingredient_id', 'ingredient__name',
+        'ingredient__measurement_unit', 'amount'
+    )
+    ingredients = defaultdict(list)
+    for recipe_id, ingredient_id, name, unit, amount in rows:
+        ingredients[recipe_id].append({
+            'id': ingredient_id,
+            'name': name,
+            'measurement_unit': unit,
+            'amount': amount,
+        })
+    return ingredients
+
+
+def build_fragments(recipe_ids):
+    """Фрагменты рецептов по id: два запроса на любое число рецептов."""
+    storage = Recipe._meta.get_field('image').storage
+    rows = Recipe.objects.filter(id__in=recipe_ids).with_tag_ids().values(
+        *RECIPE_FIELDS, *(f'author__{name}' for name in AUTHOR_FIELDS)
+    )
+    ingredients = ingredient_rows(recipe_ids)
+    fragments = {}
+    for row in rows:
+        tag_ids = row['tag_ids'].split(',') if row['tag_ids'] else ()
+        # Картинка отдаётся только после обработки.
+        ready = row['image_status'] == Recipe.IMAGE_READY
+        author = {name: row[f'author__{name}'] for name in AUTHOR_FIELDS}
+        author['is_subscribed'] = False
+        fragments[row['id']] = {
+            'id': row['id'],
+            'tags': tag_registry.tags_for(
+                int(tag_id) for tag_id in tag_ids),
+            'author': author,
+            'ingredients': ingredients.get(row['id'], []),
+            'is_favorited': False,
+            'name': row['name'],
+            'image': (storage.url(row['image'])
+                      if ready and row['image'] else None),
+            'image_srcset': thumbnails.srcset(
+                row['image_variants'] if ready else {},
+                thumbnails.storage.url),
+            'image_status': row['image_status'],
+            'text': row['text'],
+            'cooking_time': row['cooking_time'],
+            'is_in_shopping_cart': False,
+        }
+    return fragments
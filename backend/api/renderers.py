@@ -0,0 +1,61 @@
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - orjson необязателен
+    orjson = None
+
+LINE_SEPARATOR = '\u2028'.encode()
+PARAGRAPH_SEPARATOR = '\u2029'.encode()
+
+
+class TextRenderer(BaseRenderer):
+    """
+    Рендерер выгрузок списка покупок.
+    Нужен для согласования формата: сами выгрузки
+    отдаются потоком из вьюсета, ошибки — в JSON.
+    """
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        return str(data).encode(self.charset)
+
+
+class PlainTextRenderer(TextRenderer):
+    media_type = 'text/plain'
+    format = 'txt'
+
+
+class CSVRenderer(TextRenderer):
+    media_type = 'text/csv'
+    format = 'csv'
+
+
+class PDFRenderer(TextRenderer):
+    media_type = 'application/pdf'
+    format = 'pdf'
+
+
+class FastJSONRenderer(JSONRenderer):
+    """
+    JSON через orjson, если он установлен, иначе стандартный
+    рендерер DRF. Отступы по запросу клиента (indent в Accept)
+    тоже отдаются стандартным рендерером.
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if orjson is None or data is None:
+            return super().render(data, accepted_media_type,
+                                  renderer_context)
+        renderer_context = renderer_context or {}
+        if self.get_indent(accepted_media_type, renderer_context):
+            return super().render(data, accepted_media_type,
+                                  renderer_context)
+        content = orjson.dumps(data, default=JSONEncoder().default,
+                               option=orjson.OPT_NON_STR_KEYS)
+        # Как и JSONRenderer, экранируем разделители строк для JavaScript.
+        return content.replace(LINE_SEPARATOR, b'\\u2028').replace(
+            PARAGRAPH_SEPARATOR, b'\\u2029')
@@ -0,0 +1,55 @@
+"""
+Кеш готовых JSON-ответов для анонимных запросов: выдача
+для них одинакова, поэтому сериализуется один раз до
+изменения данных.
+"""
+import hashlib
+from functools import wraps
+
+from django.core.cache import caches
+from django.http import HttpResponse
+
+from api.conditional import changed_at
+
+CACHE_ALIAS = 'responses'
+CACHE_PREFIX = 'response'
+
+
+def cache_key(request, scopes):
+    params = sorted((name, sorted(values))
+                    for name, values in request.query_params.lists())
+    # Ссылки паджинации в теле ответа абсолютные.
+    state = (changed_at(scopes), request.scheme, request.get_host(),
+             request.path, params, request.accepted_media_type)
+    return f'{CACHE_PREFIX}:{hashlib.md5(repr(state).encode()).hexdigest()}'
+
+
+def cache_anonymous(*scopes):
+    """
+    Отдаёт анонимным GET-запросам сохранённое тело ответа.
+    Ключ включает время изменения scopes, поэтому любое
+    изменение данных делает прежние ответы недоступными.
+    Время меняется после фиксации транзакции (conditional.touch):
+    под новым ключом не может оказаться тело со старыми данными.
+    """
+    def decorator(method):
+        @wraps(method)
+        def wrapper(self, request, *args, **kwargs):
+            if (not request.user.is_anonymous
+                    or request.accepted_renderer.format != 'json'):
+                return method(self, request, *args, **kwargs)
+            cache = caches[CACHE_ALIAS]
+            key = cache_key(request, scopes)
+            content = cache.get(key)
+            if content is None:
+                response = method(self, request, *args, **kwargs)
+                if response.status_code != 200:
+                    return response
+                content = request.accepted_renderer.render(
+                    response.data, request.accepted_media_type,
+                    self.get_renderer_context())
+                cache.set(key, content)
+            return HttpResponse(content,
+                                content_type=request.accepted_media_type)
+        return wrapper
+    return decorator
@@ -1,13 +1,20 @@
-import base64
+import binascii
 
 import webcolors
-from django.core.files.base import ContentFile
 from djoser.serializers import (UserCreateSerializer,
                                 UserSerializer)
 from rest_framework import serializers
 from rest_framework.relations import SlugRelatedField
 from django.conf import settings
-
+from django.db.models import Manager
+from django.db import IntegrityError, transaction
+
+from api import (images, recipe_counts, recipe_fragments, recipe_rows,
+                 shopping_list, thumbnails)
+from api.conditional import RECIPES, touch, touch_user
+from api.tag_registry import tag_registry
+from recipes import counters
+from recipes.storage import content_digest, stored_digest
 from recipes.models import (Ingredient,
                             Tag,
                             Recipe,
@@ -20,15 +27,51 @@ from users.models import User
 
 class Base64ImageFieldSerializer(serializers.ImageField):
     """Сериализатор для декодирования картинки.
-       Декодирует строку base64."""
+       Декодирует строку base64 во временный файл и проверяет
+       только заголовок: полностью картинка проверяется
+       и пересжимается в фоне (api.images)."""
+    def __init__(self, **kwargs):
+        kwargs.setdefault('_DjangoImageField', images.HeaderImageField)
+        super().__init__(**kwargs)
+
     def to_internal_value(self, data):
         if isinstance(data, str) and data.startswith('data:image'):
-            format, imgstr = data.split(';base64,')
-            ext = format.split('/')[-1]
-            data = ContentFile(base64.b64decode(imgstr), name='temp.' + ext)
+            try:
+                data = images.decode_base64(data)
+            except (binascii.Error, ValueError):
+                self.fail('invalid_image')
 
         return super().to_internal_value(data)
 
+    def get_attribute(self, instance):
+        # Картинка отдаётся только после обработки.
+        if instance.image_status != Recipe.IMAGE_READY:
+            return None
+        return super().get_attribute(instance)
+
+
+class ImageSrcsetField(serializers.ReadOnlyField):
+    """Уменьшенные копии картинки рецепта: srcset по форматам."""
+
+    def __init__(self, **kwargs):
+        kwargs.setdefault('source', 'image_variants')
+        super().__init__(**kwargs)
+
+    def get_attribute(self, instance):
+        if instance.image_status != Recipe.IMAGE_READY:
+            return {}
+        return super().get_attribute(instance)
+
+    def to_representation(self, value):
+        request = self.context.get('request')
+
+        def url(name):
+            if request is None:
+                return thumbnails.storage.url(name)
+            return request.build_absolute_uri(thumbnails.storage.url(name))
+
+        return thumbnails.srcset(value, url)
+
 
 class UserCreateSerializer(UserCreateSerializer):
     """Создание пользователя с обязательными полями."""
@@ -54,6 +97,8 @@ class UserReadSerializer(UserSerializer):
                   'last_name', 'is_subscribed')
 
     def get_is_subscribed(self, obj):
+        if hasattr(obj, 'is_subscribed'):
+            return obj.is_subscribed
         request = self.context['request']
         if request.user.is_anonymous:
             return False
@@ -92,15 +137,71 @@ class TagSerializer(serializers.ModelSerializer):
         model = Tag
 
 
+def missing_ids(model, ids):
+    """id из ids, которых нет в базе: один запрос на все."""
+    found = set(model.objects.filter(id__in=ids).values_list('id', flat=True))
+    return [pk for pk in ids if pk not in found]
+
+
+def does_not_exist(pk):
+    return serializers.PrimaryKeyRelatedField.default_error_messages[
+        'does_not_exist'].format(pk_value=pk)
+
+
+class IngredientInRecipeListSerializer(serializers.ListSerializer):
+    """Ингредиенты рецепта: все id проверяются одним запросом
+       вместе с остальными полями, количества повторяющихся
+       ингредиентов складываются."""
+
+    def raw_id(self, item):
+        """id ингредиента из входных данных или None, если он неверен."""
+        try:
+            return self.child.fields['id'].to_internal_value(item['id'])
+        except (KeyError, TypeError, serializers.ValidationError):
+            return None
+
+    def to_internal_value(self, data):
+        try:
+            items = super().to_internal_value(data)
+            errors = [{} for _ in items]
+        except serializers.ValidationError as error:
+            if not isinstance(error.detail, list):
+                raise
+            items = None
+            errors = [dict(detail) for detail in error.detail]
+        ids = [self.raw_id(item) for item in data]
+        missing = set(missing_ids(Ingredient,
+                                  [pk for pk in ids if pk is not None]))
+        for pk, item_errors in zip(ids, errors):
+            if pk in missing:
+                item_errors.setdefault('id', [does_not_exist(pk)])
+        if items is None or any(errors):
+            raise serializers.ValidationError(errors)
+        amounts = {}
+        for item in items:
+            amounts[item['id']] = amounts.get(item['id'], 0) + item['amount']
+        for item, item_errors in zip(items, errors):
+            if amounts[item['id']] > settings.MAX_VALUE:
+                item_errors['amount'] = [
+                    serializers.IntegerField.default_error_messages[
+                        'max_value'].format(max_value=settings.MAX_VALUE)
+                ]
+        if any(errors):
+            raise serializers.ValidationError(errors)
+        return [{'id': ingredient_id, 'amount': amount}
+                for ingredient_id, amount in amounts.items()]
+
+
 class IngredientInRecipeWriteSerializer(serializers.ModelSerializer):
     """Сериализатор для игредиентов в рецепте."""
-    id = serializers.PrimaryKeyRelatedField(queryset=Ingredient.objects.all())
+    id = serializers.IntegerField()
     amount = serializers.IntegerField(min_value=settings.MIN_VALUE,
                                       max_value=settings.MAX_VALUE)
 
     class Meta:
         model = IngredientAmount
         fields = ('id', 'amount')
+        list_serializer_class = IngredientInRecipeListSerializer
 
 
 class RecipeCreateSerializer(serializers.ModelSerializer):
@@ -116,9 +217,8 @@ class RecipeCreateSerializer(serializers.ModelSerializer):
     ingredients = IngredientInRecipeWriteSerializer(
         many=True
     )
-    tags = serializers.PrimaryKeyRelatedField(
-        queryset=Tag.objects.all(),
-        many=True
+    tags = serializers.ListField(
+        child=serializers.IntegerField()
     )
     cooking_time = serializers.IntegerField(
         min_value=settings.MIN_VALUE,
@@ -130,41 +230,120 @@ class RecipeCreateSerializer(serializers.ModelSerializer):
                   'image', 'name', 'text',
                   'cooking_time', 'author')
 
+    def validate_tags(self, value):
+        """Все id тегов проверяются одним запросом."""
+        tag_ids = list(dict.fromkeys(value))
+        missing = missing_ids(Tag, tag_ids)
+        if missing:
+            raise serializers.ValidationError(
+                [does_not_exist(pk) for pk in missing])
+        return tag_ids
+
     def create_ingredients(self, ingredients, recipe):
         IngredientAmount.objects.bulk_create([
             IngredientAmount(
-                ingredient=ingredient.get('id'),
+                ingredient_id=ingredient.get('id'),
                 recipe=recipe,
                 amount=ingredient.get('amount')
             )
             for ingredient in ingredients
         ])
 
+    @transaction.atomic
     def create(self, validated_data):
         tags = validated_data.pop('tags')
         ingredients = validated_data.pop('ingredients')
+        image = validated_data.pop('image', None)
+        if image:
+            validated_data['image_upload'] = images.store_upload(image)
+            validated_data['image_status'] = Recipe.IMAGE_PROCESSING
         recipe = Recipe.objects.create(**validated_data)
-        recipe.tags.set(tags)
+        recipe.tags.add(*tags)
         self.create_ingredients(ingredients, recipe)
+        # Нового рецепта нет в избранном и списках покупок,
+        # а на себя пользователь не подписан.
+        recipe.is_favorited = recipe.is_in_shopping_cart = False
+        recipe.author_is_subscribed = False
+        if recipe.image_upload:
+            images.schedule(recipe)
         return recipe
 
+    def update_ingredients(self, ingredients, recipe):
+        """
+        Приводит ингредиенты рецепта к ingredients минимальным
+        числом изменений. Возвращает, изменилось ли что-нибудь.
+        """
+        amounts = {item['id']: item['amount'] for item in ingredients}
+        existing = {}
+        stale = []
+        for row in IngredientAmount.objects.filter(recipe=recipe):
+            ingredient_id = row.ingredient_id
+            if ingredient_id not in amounts or ingredient_id in existing:
+                stale.append(row.id)
+            else:
+                existing[ingredient_id] = row
+        changed = []
+        for ingredient_id, row in existing.items():
+            if row.amount != amounts[ingredient_id]:
+                row.amount = amounts[ingredient_id]
+                changed.append(row)
+        added = [
+            IngredientAmount(recipe=recipe, ingredient_id=ingredient_id,
+                             amount=amount)
+            for ingredient_id, amount in amounts.items()
+            if ingredient_id not in existing
+        ]
+        if stale:
+            IngredientAmount.objects.filter(id__in=stale).delete()
+        if changed:
+            IngredientAmount.objects.bulk_update(changed, ['amount'])
+        if added:
+            IngredientAmount.objects.bulk_create(added)
+        return bool(stale or changed or added)
+
+    @staticmethod
+    def update_image(image, recipe):
+        """
+        Заменяет картинку рецепта. Те же байты, что уже
+        хранятся, не пишутся. Возвращает, заменена ли картинка.
+        """
+        if not image and not recipe.image and not recipe.image_upload:
+            return False
+        if image and recipe.image and stored_digest(
+            recipe.image.name
+        ) == content_digest(image):
+            image.close()
+            return False
+        images.accept(recipe, image)
+        return True
+
+    @transaction.atomic
     def update(self, instance, validated_data):
-        recipe = instance
-        instance.image = validated_data.get('image', instance.image)
-        instance.name = validated_data.get('name', instance.name)
-        instance.text = validated_data.get('text', instance.name)
-        instance.cooking_time = validated_data.get(
-            'cooking_time',
-            instance.cooking_time
-        )
-        instance.tags.clear()
-        instance.ingredients.clear()
-        tags = validated_data.get('tags')
-        instance.tags.set(tags)
-        ingredients = validated_data.get('ingredients')
-        IngredientAmount.objects.filter(recipe=recipe).delete()
-        self.create_ingredients(ingredients, recipe)
-        instance.save()
+        changed = [
+            field for field in ('name', 'text', 'cooking_time')
+            if field in validated_data
+            and validated_data[field] != getattr(instance, field)
+        ]
+        for field in changed:
+            setattr(instance, field, validated_data[field])
+        image_changed = 'image' in validated_data and self.update_image(
+            validated_data['image'], instance)
+        if image_changed:
+            changed += ['image', 'image_variants', 'image_status',
+                        'image_upload']
+        if 'tags' in validated_data:
+            instance.tags.set(validated_data['tags'])
+        if 'ingredients' in validated_data and self.update_ingredients(
+            validated_data['ingredients'], instance
+        ):
+            shopping_list.invalidate_recipe(instance.id)
+            if not changed:
+                recipe_fragments.invalidate([instance.id])
+                touch(RECIPES)
+        if changed:
+            instance.save(update_fields=changed)
+        if image_changed and instance.image_upload:
+            images.schedule(instance)
         return instance
 
     def to_representation(self, instance):
@@ -186,11 +365,18 @@ class Hex2NameColor(serializers.Field):
         return data
 
 
+class RecipeListSerializer(serializers.ListSerializer):
+    """Список рецептов: фрагменты всей страницы читаются разом."""
+
+    def to_representation(self, data):
+        if isinstance(data, Manager):
+            data = data.all()
+        return self.child.represent(list(data))
+
+
 class RecipeReadSerializer(serializers.ModelSerializer):
     """Просмотр рецепта."""
-    tags = TagSerializer(
-        many=True,
-    )
+    tags = serializers.SerializerMethodField()
     ingredients = IngredientsInRecipeSerializer(
         many=True,
         source='recipe'
@@ -198,23 +384,91 @@ class RecipeReadSerializer(serializers.ModelSerializer):
     author = UserReadSerializer()
     is_favorited = serializers.SerializerMethodField()
     is_in_shopping_cart = serializers.SerializerMethodField()
+    image = Base64ImageFieldSerializer(read_only=True)
+    image_srcset = ImageSrcsetField()
 
     class Meta:
         model = Recipe
         fields = (
             'id', 'tags', 'author', 'ingredients',
             'is_favorited',
-            'name', 'image', 'text', 'cooking_time',
-            'is_in_shopping_cart',
+            'name', 'image', 'image_srcset', 'image_status', 'text',
+            'cooking_time', 'is_in_shopping_cart',
         )
+        list_serializer_class = RecipeListSerializer
+
+    def to_representation(self, instance):
+        return self.represent([instance])[0]
+
+    def represent(self, recipes):
+        """
+        Общая часть представления берётся из кеша фрагментов,
+        недостающие строятся из строк values() (см. recipe_rows).
+        Признаки пользователя накладываются из самих recipes.
+        """
+        fragments, keys = recipe_fragments.get_many(
+            [recipe.id for recipe in recipes])
+        missing = [recipe.id for recipe in recipes
+                   if recipe.id not in fragments]
+        if missing:
+            loaded = recipe_rows.build_fragments(missing)
+            recipe_fragments.set_many(loaded, keys)
+            fragments.update(loaded)
+        return [self.overlay(fragments[recipe.id], recipe)
+                for recipe in recipes if recipe.id in fragments]
+
+    def fragment(self, instance):
+        """
+        Представление для анонимного пользователя
+        с относительной ссылкой на картинку через поля
+        сериализатора. Эталон для recipe_rows.
+        """
+        instance.author.is_subscribed = False
+        serializer = RecipeReadSerializer(context={'request': None})
+        return super(RecipeReadSerializer, serializer).to_representation(
+            instance)
+
+    def overlay(self, fragment, recipe):
+        request = self.context['request']
+        data = dict(fragment)
+        if data['image']:
+            data['image'] = request.build_absolute_uri(data['image'])
+            data['image_srcset'] = thumbnails.absolute(
+                data['image_srcset'], request)
+        data['author'] = dict(data['author'],
+                              is_subscribed=self.get_author_subscribed(
+                                  recipe))
+        data['is_favorited'] = self.get_is_favorited(recipe)
+        data['is_in_shopping_cart'] = self.get_is_in_shopping_cart(recipe)
+        return data
+
+    def get_author_subscribed(self, obj):
+        if hasattr(obj, 'author_is_subscribed'):
+            return obj.author_is_subscribed
+        request = self.context['request']
+        if request.user.is_anonymous:
+            return False
+        return request.user.subscriber.filter(
+            author_id=obj.author_id).exists()
+
+    def get_tags(self, obj):
+        if hasattr(obj, 'tag_ids'):
+            tag_ids = obj.tag_ids.split(',') if obj.tag_ids else ()
+        else:
+            tag_ids = obj.tags.values_list('id', flat=True)
+        return tag_registry.tags_for(int(tag_id) for tag_id in tag_ids)
 
     def get_is_favorited(self, obj):
+        if hasattr(obj, 'is_favorited'):
+            return obj.is_favorited
         request = self.context['request']
         if request.user.is_anonymous:
             return False
         return request.user.favorites.filter(recipe=obj).exists()
 
     def get_is_in_shopping_cart(self, obj):
+        if hasattr(obj, 'is_in_shopping_cart'):
+            return obj.is_in_shopping_cart
         request = self.context['request']
         if request.user.is_anonymous:
             return False
@@ -226,7 +480,7 @@ class SubscribeSerializer(serializers.ModelSerializer):
        Данные о пользователе, на которого
        сделана подписка."""
 
-    recipes_count = serializers.SerializerMethodField()
+    recipes_count = serializers.ReadOnlyField()
     is_subscribed = serializers.SerializerMethodField()
     recipes = serializers.SerializerMethodField()
 
@@ -243,10 +497,16 @@ class SubscribeSerializer(serializers.ModelSerializer):
             'recipes_count',
         )
 
-    def get_recipes_count(self, obj):
-        return obj.recipes.count()
+    @staticmethod
+    def get_recipes_limit(request):
+        limit = request.query_params.get('recipes_limit')
+        if limit is not None and limit.isdigit():
+            return int(limit)
+        return None
 
     def get_is_subscribed(self, obj):
+        if hasattr(obj, 'is_subscribed'):
+            return obj.is_subscribed
         request = self.context['request']
         if request.user.is_anonymous:
             return False
@@ -254,17 +514,20 @@ class SubscribeSerializer(serializers.ModelSerializer):
 
     def get_recipes(self, obj):
         request = self.context['request']
-        limit_recipes = request.query_params.get('recipes_limit')
-        if limit_recipes is not None:
-            recipes = obj.recipes.all()[:(int(limit_recipes))]
+        if hasattr(obj, 'latest_recipes'):
+            recipes = obj.latest_recipes
         else:
             recipes = obj.recipes.all()
+            limit_recipes = self.get_recipes_limit(request)
+            if limit_recipes is not None:
+                recipes = recipes[:limit_recipes]
         return RecipeShortSerializer(recipes, many=True,
                                      context={'request': request}).data
 
 
 class RecipeShortSerializer(serializers.ModelSerializer):
     image = Base64ImageFieldSerializer()
+    image_srcset = ImageSrcsetField()
 
     class Meta:
         model = Recipe
@@ -272,27 +535,53 @@ class RecipeShortSerializer(serializers.ModelSerializer):
             'id',
             'name',
             'image',
+            'image_srcset',
+            'image_status',
             'cooking_time'
         )
 
 
-class SubscribeCreateSerializer(serializers.ModelSerializer):
+class UniqueRelationSerializer(serializers.ModelSerializer):
+    """
+    Создание связи, уникальность которой обеспечивает
+    ограничение в базе: вместо проверки перед вставкой
+    перехватывается ошибка целостности. Вставка идёт в точке
+    сохранения, чтобы ошибка не ломала внешнюю транзакцию.
+    """
+    duplicate_error = None
+
+    def create(self, validated_data):
+        try:
+            with transaction.atomic():
+                return super().create(validated_data)
+        except IntegrityError:
+            raise serializers.ValidationError(
+                {'errors': [self.duplicate_error]})
+
+
+class SubscribeCreateSerializer(UniqueRelationSerializer):
     """Сериализатор для создания подписки."""
+    duplicate_error = 'Вы уже подписаны на этого автора.'
 
     class Meta:
         model = Subscribe
         fields = ('user', 'author')
+        read_only_fields = fields
+        validators = []
+
+    @transaction.atomic
+    def create(self, validated_data):
+        instance = super().create(validated_data)
+        counters.change_followers_count(instance.author_id, 1)
+        touch_user(instance.user_id)
+        return instance
 
     def validate(self, data):
         user = self.context['request'].user
-        author = data['author']
+        author = self.context['author']
         if user == author:
             raise serializers.ValidationError({
-                'errors': 'Нельзя подписаться на себя.'
-            })
-        if user.subscriber.filter(author=author).exists():
-            raise serializers.ValidationError({
-                'errors': 'Вы уже подписаны на этого автора.'
+                'errors': ['Нельзя подписаться на себя.']
             })
         return data
 
@@ -303,20 +592,23 @@ class SubscribeCreateSerializer(serializers.ModelSerializer):
         ).data
 
 
-class FavoriteSerializer(serializers.ModelSerializer):
+class FavoriteSerializer(UniqueRelationSerializer):
     """Сериализатор для добавления в избранное."""
+    duplicate_error = 'Рецепт уже добавлен!'
 
     class Meta:
         model = Favorite
         fields = ('user', 'recipe')
+        read_only_fields = fields
+        validators = []
 
-    def validate(self, data):
-        user = self.context['request'].user
-        recipe = data['recipe']
-        if user.favorites.filter(recipe=recipe).exists():
-            raise serializers.ValidationError(
-                {'errors': 'Рецепт уже добавлен!'})
-        return data
+    @transaction.atomic
+    def create(self, validated_data):
+        instance = super().create(validated_data)
+        counters.change_favorites_count(instance.recipe_id, 1)
+        recipe_counts.invalidate(instance.user_id)
+        touch_user(instance.user_id)
+        return instance
 
     def to_representation(self, instance):
         return RecipeShortSerializer(
@@ -324,20 +616,22 @@ class FavoriteSerializer(serializers.ModelSerializer):
             context={'request': self.context['request']}).data
 
 
-class ShoppingCartSerializer(serializers.ModelSerializer):
+class ShoppingCartSerializer(UniqueRelationSerializer):
     """Сериализатор для добавления в список покупок."""
+    duplicate_error = 'Рецепт уже добавлен в список покупок!'
 
     class Meta:
         fields = ['recipe', 'user']
+        read_only_fields = fields
         model = ShoppingCart
+        validators = []
 
-    def validate(self, data):
-        user = self.context['request'].user
-        recipe = data['recipe']
-        if user.shopping_cart.filter(recipe=recipe).exists():
-            raise serializers.ValidationError(
-                {'errors': 'Рецепт уже добавлен в список покупок!'})
-        return data
+    def create(self, validated_data):
+        instance = super().create(validated_data)
+        shopping_list.invalidate([instance.user_id])
+        recipe_counts.invalidate(instance.user_id)
+        touch_user(instance.user_id)
+        return instance
 
     def to_representation(self, instance):
         return RecipeShortSerializer(
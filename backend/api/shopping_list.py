@@ -0,0 +1,179 @@
+"""Список покупок: агрегация ингредиентов и выгрузка в разных форматах."""
+import csv
+import io
+import json
+from tempfile import SpooledTemporaryFile
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Sum
+from reportlab.pdfbase import pdfmetrics, ttfonts
+from reportlab.pdfgen import canvas
+
+from recipes.models import IngredientAmount, ShoppingCart
+
+FONT_NAME = 'Arial'
+FONT_PATH = settings.BASE_DIR / 'docs' / 'arialfont.ttf'
+# Файл в памяти до 1 МБ, дальше сбрасывается на диск.
+SPOOL_MAX_SIZE = 1024 * 1024
+CACHE_PREFIX = 'shopping_list'
+
+
+def register_fonts():
+    """Регистрирует шрифт один раз на процесс."""
+    if FONT_NAME not in pdfmetrics.getRegisteredFontNames():
+        pdfmetrics.registerFont(ttfonts.TTFont(FONT_NAME, str(FONT_PATH)))
+
+
+def aggregate_ingredients(user):
+    """Суммарное количество каждого ингредиента из списка покупок."""
+    return IngredientAmount.objects.filter(
+        recipe__recipe_shopping_cart__user=user
+    ).values(
+        'ingredient__name', 'ingredient__measurement_unit'
+    ).annotate(
+        amount=Sum('amount')
+    ).order_by('ingredient__name')
+
+
+def cache_key(user_id, kind):
+    return f'{CACHE_PREFIX}:{user_id}:{kind}'
+
+
+def count_access(kind, hit):
+    """Увеличивает счётчик попаданий или промахов кеша."""
+    key = f'{CACHE_PREFIX}:stats:{kind}:{"hits" if hit else "misses"}'
+    cache.add(key, 0, timeout=None)
+    cache.incr(key)
+
+
+def cache_stats():
+    """Счётчики попаданий и промахов кеша списков покупок."""
+    keys = [f'{CACHE_PREFIX}:stats:{kind}:{counter}'
+            for kind in ('ingredients', 'pdf')
+            for counter in ('hits', 'misses')]
+    values = cache.get_many(keys)
+    return {key.split(':', 2)[2]: values.get(key, 0) for key in keys}
+
+
+def invalidate(user_ids):
+    """
+    Сбрасывает закешированные списки покупок пользователей
+    после фиксации транзакции: иначе параллельный запрос
+    успел бы сохранить список по ещё не изменённым данным.
+    """
+    keys = [cache_key(user_id, kind)
+            for user_id in user_ids
+            for kind in ('ingredients', 'pdf')]
+    transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+def invalidate_recipe(recipe_id):
+    """Сбрасывает списки покупок всех, у кого рецепт в корзине."""
+    invalidate(ShoppingCart.objects.filter(
+        recipe_id=recipe_id
+    ).values_list('user_id', flat=True))
+
+
+def get_ingredients(user):
+    """Агрегированный список покупок из кеша или из базы."""
+    key = cache_key(user.id, 'ingredients')
+    ingredients = cache.get(key)
+    count_access('ingredients', ingredients is not None)
+    if ingredients is None:
+        ingredients = list(aggregate_ingredients(user))
+        cache.set(key, ingredients, settings.SHOPPING_LIST_CACHE_TIMEOUT)
+    return ingredients
+
+
+def get_pdf(user):
+    """
+    PDF со списком покупок. Небольшие файлы кешируются,
+    большие каждый раз рисуются во временный файл.
+    """
+    key = cache_key(user.id, 'pdf')
+    content = cache.get(key)
+    count_access('pdf', content is not None)
+    if content is not None:
+        return io.BytesIO(content)
+    file = render_pdf(format_lines(get_ingredients(user)))
+    if file.seek(0, io.SEEK_END) <= SPOOL_MAX_SIZE:
+        file.seek(0)
+        cache.set(key, file.read(), settings.SHOPPING_LIST_CACHE_TIMEOUT)
+    file.seek(0)
+    return file
+
+
+def format_lines(ingredients):
+    """Строки списка покупок: «название - количество единица»."""
+    for ingredient in ingredients:
+        yield (f'{ingredient["ingredient__name"]}'
+               f' - {ingredient["amount"]}'
+               f' {ingredient["ingredient__measurement_unit"]}')
+
+
+class Echo:
+    """Буфер для csv.writer, возвращающий записанную строку."""
+
+    def write(self, value):
+        return value
+
+
+def stream_text(ingredients):
+    for line in format_lines(ingredients):
+        yield line + '\n'
+
+
+def stream_csv(ingredients):
+    writer = csv.writer(Echo())
+    yield writer.writerow(('name', 'amount', 'measurement_unit'))
+    for ingredient in ingredients:
+        yield writer.writerow((ingredient['ingredient__name'],
+                               ingredient['amount'],
+                               ingredient['ingredient__measurement_unit']))
+
+
+def stream_json(ingredients):
+    separator = '['
+    for ingredient in ingredients:
+        yield separator + json.dumps({
+            'name': ingredient['ingredient__name'],
+            'amount': ingredient['amount'],
+            'measurement_unit': ingredient['ingredient__measurement_unit'],
+        }, ensure_ascii=False)
+        separator = ','
+    yield '[]' if separator == '[' else ']'
+
+
+STREAMS = {
+    'txt': stream_text,
+    'csv': stream_csv,
+    'json': stream_json,
+}
+
+
+def render_pdf(lines):
+    """
+    Рисует список покупок, перенося строки на новые страницы.
+    Возвращает файл, готовый к потоковой отдаче.
+    """
+    register_fonts()
+    file = SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE)
+    pdf = canvas.Canvas(file)
+    pdf.setFont(FONT_NAME, settings.HEAD_FONT_SIZE)
+    pdf.drawString(settings.HEAD_INDENT, settings.HEAD_HEIGHT,
+                   'Ваш список покупок:')
+    pdf.setFont(FONT_NAME, settings.TEXT_FONT_SIZE)
+    height = settings.TEXT_HEIGHT
+    for line in lines:
+        if height < settings.TEXT_BOTTOM:
+            pdf.showPage()
+            pdf.setFont(FONT_NAME, settings.TEXT_FONT_SIZE)
+            height = settings.HEAD_HEIGHT
+        pdf.drawString(settings.TEXT_INDENT, height, line)
+        height -= settings.LINE_SPACE
+    pdf.showPage()
+    pdf.save()
+    file.seek(0)
+    return file
@@ -0,0 +1,101 @@
+from django.db.models.signals import (m2m_changed,
+                                      post_delete,
+                                      post_save,
+                                      pre_delete)
+from django.dispatch import receiver
+
+from api import (conditional,
+                 images,
+                 ingredient_index,
+                 recipe_counts,
+                 recipe_fragments,
+                 shopping_list,
+                 tag_registry)
+from recipes import counters
+from recipes.models import (Ingredient,
+                            Recipe,
+                            ShoppingCart,
+                            Tag)
+from users.models import User
+
+
+@receiver(post_save, sender=Recipe)
+def recipe_saved(sender, instance, created, **kwargs):
+    recipe_counts.invalidate()
+    recipe_fragments.invalidate([instance.id])
+    conditional.touch(conditional.RECIPES)
+    if created:
+        counters.change_recipes_count(instance.author_id, 1)
+
+
+@receiver(pre_delete, sender=Recipe)
+def recipe_deleted(sender, instance, **kwargs):
+    shopping_list.invalidate_recipe(instance.id)
+    counters.change_recipes_count(instance.author_id, -1)
+
+
+@receiver(post_delete, sender=Recipe)
+def recipe_removed(sender, instance, **kwargs):
+    recipe_counts.invalidate()
+    recipe_fragments.invalidate([instance.id])
+    conditional.touch(conditional.RECIPES)
+    images.release(instance.image.name, instance.image_variants)
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+def recipe_tags_changed(sender, instance, action, reverse, pk_set,
+                        **kwargs):
+    if action.startswith('post_'):
+        recipe_counts.invalidate()
+        if not reverse:
+            recipe_fragments.invalidate([instance.id])
+        elif pk_set:
+            recipe_fragments.invalidate(pk_set)
+        else:
+            recipe_fragments.invalidate_all()
+        conditional.touch(conditional.RECIPES)
+
+
+@receiver(pre_delete, sender=User)
+def user_deleted(sender, instance, **kwargs):
+    counters.user_deleted(instance)
+
+
+@receiver(post_save, sender=User)
+def user_changed(sender, instance, update_fields=None, created=False,
+                 **kwargs):
+    """
+    Данные автора входят в выдачу его рецептов. Рецепты удалённого
+    пользователя удаляются каскадом и сбрасывают кеши сами.
+    """
+    if created:
+        return
+    if (update_fields is not None
+            and not set(update_fields) & set(User.author_fields)):
+        return
+    if instance.author_changed() and instance.recipes_count:
+        conditional.touch(conditional.RECIPES)
+        recipe_fragments.invalidate(
+            instance.recipes.values_list('id', flat=True))
+
+
+@receiver((post_save, post_delete), sender=Tag)
+def tag_changed(sender, **kwargs):
+    tag_registry.invalidate()
+    recipe_fragments.invalidate_all()
+    conditional.touch(conditional.TAGS, conditional.RECIPES)
+
+
+@receiver((post_save, post_delete), sender=Ingredient)
+def ingredient_index_changed(sender, **kwargs):
+    ingredient_index.invalidate()
+    recipe_fragments.invalidate_all()
+    conditional.touch(conditional.INGREDIENTS, conditional.RECIPES)
+
+
+@receiver(post_save, sender=Ingredient)
+def ingredient_changed(sender, instance, created, **kwargs):
+    if not created:
+        shopping_list.invalidate(ShoppingCart.objects.filter(
+            recipe__recipe__ingredient=instance
+        ).values_list('user_id', flat=True).distinct())
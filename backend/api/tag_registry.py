@@ -0,0 +1,76 @@
+"""
+Теги в памяти процесса. Их несколько штук и они почти
+не меняются, поэтому список тегов, фильтр и теги
+в рецептах обходятся без запросов к базе.
+"""
+import threading
+
+from django.core.cache import cache
+from django.db import transaction
+
+from recipes.models import Tag
+
+VERSION_KEY = 'tag_registry:version'
+
+
+def invalidate():
+    """
+    Помечает теги всех процессов как устаревшие после фиксации
+    транзакции: иначе параллельный запрос перечитал бы старые
+    теги и запомнил их под новой версией.
+    """
+    transaction.on_commit(next_version)
+
+
+def next_version():
+    if not cache.add(VERSION_KEY, 1, timeout=None):
+        cache.incr(VERSION_KEY)
+
+
+class TagRegistry:
+    """Сериализованные теги в порядке модели и их id по слагу."""
+
+    def __init__(self):
+        self.rows = []
+        self.by_id = {}
+        self.ids_by_slug = {}
+        self.version = None
+        self.lock = threading.Lock()
+
+    def build(self):
+        rows = list(Tag.objects.values(
+            *(field.attname for field in Tag._meta.concrete_fields)))
+        self.rows = rows
+        self.by_id = {row['id']: row for row in rows}
+        self.ids_by_slug = {row['slug']: row['id'] for row in rows}
+
+    def refresh(self):
+        """Перечитывает теги, если они менялись."""
+        version = cache.get(VERSION_KEY, 0)
+        if version == self.version:
+            return
+        with self.lock:
+            if version != self.version:
+                self.build()
+                self.version = version
+
+    def all(self):
+        self.refresh()
+        return self.rows
+
+    def get(self, tag_id):
+        self.refresh()
+        return self.by_id.get(tag_id)
+
+    def slug_ids(self):
+        self.refresh()
+        return self.ids_by_slug
+
+    def tags_for(self, tag_ids):
+        """Теги с данными id в порядке модели."""
+        self.refresh()
+        tag_ids = set(tag_ids)
+        return [row for row in self.rows if row['id'] in tag_ids]
+
+
+tag_registry = TagRegistry()
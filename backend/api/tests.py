@@ -0,0 +1,715 @@
+import base64
+import io
+import json
+import os
+import shutil
+import tempfile
+from io import StringIO
+from unittest import mock
+
+from django.contrib.admin import site
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.test import RequestFactory, override_settings
+from django.test.utils import CaptureQueriesContext
+from PIL import Image
+from rest_framework.test import APITestCase
+
+from api import (images, ingredient_index, recipe_fragments, recipe_rows,
+                 shopping_list, tag_registry, thumbnails)
+from api.serializers import RecipeCreateSerializer, RecipeReadSerializer
+from api.conditional import RECIPES, changed_at, touch
+from api.management.dataset import clear_caches
+from recipes import counters
+from recipes.admin import RecipeAdmin
+from recipes.models import (Ingredient, IngredientAmount, Recipe, Subscribe,
+                            Tag)
+from users.models import User
+
+RECIPES_URL = '/api/recipes/'
+
+
+class RecipeListTestCase(APITestCase):
+    """60 рецептов трёх авторов: у рецепта номер n первые n % 3 + 1 тега."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.tags = [
+            Tag.objects.create(name=f'Тег {number}',
+                               color=f'#00000{number}',
+                               slug=f'tag{number}')
+            for number in range(3)
+        ]
+        ingredients = [
+            Ingredient.objects.create(name=f'Ингредиент {number}',
+                                      measurement_unit='г')
+            for number in range(10)
+        ]
+        authors = [
+            User.objects.create(email=f'user{number}@foodgram.ru',
+                                username=f'user{number}')
+            for number in range(3)
+        ]
+        Recipe.objects.bulk_create(
+            Recipe(author=authors[number % len(authors)],
+                   name=f'Рецепт {number}', text='Текст рецепта',
+                   cooking_time=number % 60 + 1)
+            for number in range(60))
+        recipes = list(Recipe.objects.order_by('id'))
+        Recipe.tags.through.objects.bulk_create(
+            Recipe.tags.through(recipe=recipe, tag=tag)
+            for number, recipe in enumerate(recipes)
+            for tag in cls.tags[:number % len(cls.tags) + 1])
+        IngredientAmount.objects.bulk_create(
+            IngredientAmount(recipe=recipe,
+                             ingredient=ingredients[(number + shift) % 10],
+                             amount=shift + 1)
+            for number, recipe in enumerate(recipes)
+            for shift in range(3))
+        counters.recount()
+
+    def setUp(self):
+        clear_caches()
+
+
+class RecipeListQueriesTest(RecipeListTestCase):
+    """Число запросов выдачи рецептов не зависит от размера страницы."""
+
+    def count_queries(self, url):
+        clear_caches()
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(context)
+
+    def test_anonymous_list_queries_do_not_depend_on_limit(self):
+        queries = self.count_queries(f'{RECIPES_URL}?limit=6')
+        clear_caches()
+        with self.assertNumQueries(queries):
+            response = self.client.get(f'{RECIPES_URL}?limit=50')
+        self.assertEqual(len(response.json()['results']), 50)
+
+    def test_user_list_queries_do_not_depend_on_limit(self):
+        self.client.force_authenticate(User.objects.get(username='user0'))
+        queries = self.count_queries(f'{RECIPES_URL}?limit=6')
+        clear_caches()
+        with self.assertNumQueries(queries):
+            response = self.client.get(f'{RECIPES_URL}?limit=50')
+        self.assertEqual(len(response.json()['results']), 50)
+
+
+class AnonymousResponseCacheTest(RecipeListTestCase):
+    """Сохранённые ответы анонимным сменяются после фиксации изменений."""
+
+    def test_response_refreshed_after_commit(self):
+        url = f'{RECIPES_URL}?limit=50'
+        recipe = Recipe.objects.order_by('-pub_date', '-id').first()
+        self.assertEqual(self.client.get(url).json()['results'][0]['name'],
+                         recipe.name)
+        with self.captureOnCommitCallbacks() as callbacks:
+            recipe.name = 'Новое название'
+            recipe.save(update_fields=['name'])
+            with self.assertNumQueries(0):
+                self.client.get(url)
+        for callback in callbacks:
+            callback()
+        self.assertEqual(self.client.get(url).json()['results'][0]['name'],
+                         'Новое название')
+
+
+class RecipeTagFilterTest(RecipeListTestCase):
+    """Фильтр по нескольким тегам: рецепт с любым из них, один раз."""
+
+    def get_results(self, url):
+        results = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            data = response.json()
+            results += data['results']
+            url = data['next']
+        return data.get('count'), [recipe['id'] for recipe in results]
+
+    def test_tags_without_duplicates(self):
+        count, ids = self.get_results(
+            f'{RECIPES_URL}?tags=tag1&tags=tag2&limit=50')
+        expected = Recipe.objects.filter(
+            tags__slug__in=('tag1', 'tag2')).distinct().count()
+        self.assertEqual(expected, 40)
+        self.assertEqual(count, expected)
+        self.assertEqual(len(ids), expected)
+        self.assertEqual(len(set(ids)), expected)
+
+    def test_tags_count_with_small_pages(self):
+        count, ids = self.get_results(
+            f'{RECIPES_URL}?tags=tag0&tags=tag1&tags=tag2&limit=7')
+        self.assertEqual(count, 60)
+        self.assertEqual(sorted(ids), sorted(
+            Recipe.objects.values_list('id', flat=True)))
+
+    def test_tags_with_cursor(self):
+        _, ids = self.get_results(
+            f'{RECIPES_URL}?tags=tag2&tags=tag1&cursor=&limit=7')
+        self.assertEqual(len(ids), 40)
+        self.assertEqual(len(set(ids)), 40)
+
+    def test_unknown_tag(self):
+        response = self.client.get(f'{RECIPES_URL}?tags=tag1&tags=unknown')
+        self.assertEqual(response.status_code, 400)
+
+
+class RelationCreateTest(APITestCase):
+    """Подписка, избранное и список покупок."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(email='user@foodgram.ru',
+                                       username='user')
+        cls.author = User.objects.create(email='author@foodgram.ru',
+                                         username='author')
+        cls.recipe = Recipe.objects.create(
+            author=cls.author, name='Рецепт', text='Текст рецепта',
+            cooking_time=10)
+
+    def setUp(self):
+        clear_caches()
+        self.client.force_authenticate(self.user)
+
+    def test_subscribe(self):
+        url = f'/api/users/{self.author.id}/subscribe/'
+        response = self.client.post(url)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['id'], self.author.id)
+        self.assertTrue(response.json()['is_subscribed'])
+        self.assertEqual(self.client.post(url).status_code, 400)
+
+    def test_subscribe_to_self(self):
+        response = self.client.post(f'/api/users/{self.user.id}/subscribe/')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(self.user.subscriber.exists())
+
+    def test_favorite_and_shopping_cart(self):
+        for action, related in (('favorite', 'favorites'),
+                                ('shopping_cart', 'shopping_cart')):
+            with self.subTest(action=action):
+                url = f'{RECIPES_URL}{self.recipe.id}/{action}/'
+                response = self.client.post(url)
+                self.assertEqual(response.status_code, 201)
+                self.assertEqual(response.json()['id'], self.recipe.id)
+                self.assertEqual(self.client.post(url).status_code, 400)
+                # Ошибка дубликата не ломает внешнюю транзакцию.
+                self.assertEqual(
+                    getattr(self.user, related).filter(
+                        recipe=self.recipe).count(), 1)
+
+
+class SubscriptionRecipesTest(APITestCase):
+    """Последние рецепты авторов в подписках, в том числе плодовитых."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(email='user@foodgram.ru',
+                                       username='user')
+        cls.authors = [
+            User.objects.create(email=f'author{number}@foodgram.ru',
+                                username=f'author{number}')
+            for number in range(2)
+        ]
+        for author, count in zip(cls.authors, (40, 2)):
+            Subscribe.objects.create(user=cls.user, author=author)
+            for number in range(count):
+                Recipe.objects.create(
+                    author=author, name=f'Рецепт {number}',
+                    text='Текст рецепта', cooking_time=10)
+
+    def setUp(self):
+        clear_caches()
+        self.client.force_authenticate(self.user)
+
+    def expected(self, limit):
+        return [
+            list(author.recipes.order_by('-pub_date', '-id').values_list(
+                'id', flat=True)[:limit])
+            for author in self.authors
+        ]
+
+    def test_latest_by_author(self):
+        for over_clause in (True, False):
+            with self.subTest(over_clause=over_clause), mock.patch.object(
+                    connection.features, 'supports_over_clause',
+                    over_clause):
+                recipes = Recipe.objects.latest_by_author(3, self.authors)
+                self.assertEqual(
+                    [[recipe.id for recipe in recipes
+                      if recipe.author_id == author.id]
+                     for author in self.authors],
+                    self.expected(3))
+
+    def test_subscriptions_queries(self):
+        counts = []
+        for limit in (3, 30):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(
+                    f'/api/users/subscriptions/?recipes_limit={limit}')
+            self.assertEqual(
+                [[recipe['id'] for recipe in author['recipes']]
+                 for author in response.json()['results']],
+                self.expected(limit))
+            counts.append(len(queries))
+        self.assertEqual(counts[0], counts[1])
+
+
+class RecipeWriteTestCase(APITestCase):
+    """Автор и 50 ингредиентов для его рецептов."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create(email='author@foodgram.ru',
+                                         username='author')
+        cls.ingredients = [
+            Ingredient.objects.create(name=f'Ингредиент {number}',
+                                      measurement_unit='г')
+            for number in range(50)
+        ]
+
+    def setUp(self):
+        clear_caches()
+        self.client.force_authenticate(self.author)
+
+    def create_recipe(self, ingredients):
+        recipe = Recipe.objects.create(
+            author=self.author, name='Рецепт', text='Текст рецепта',
+            cooking_time=10)
+        IngredientAmount.objects.bulk_create(
+            IngredientAmount(recipe=recipe, ingredient=ingredient, amount=1)
+            for ingredient in self.ingredients[:ingredients])
+        return recipe
+
+
+class RecipeWriteQueriesTest(RecipeWriteTestCase):
+    """Число запросов удаления и правки не зависит от числа ингредиентов."""
+
+    def count_queries(self, method, ingredients, **kwargs):
+        url = f'{RECIPES_URL}{self.create_recipe(ingredients).id}/'
+        clear_caches()
+        with CaptureQueriesContext(connection) as context:
+            response = getattr(self.client, method)(url, **kwargs)
+        self.assertLess(response.status_code, 300)
+        return len(context)
+
+    def test_delete(self):
+        self.assertEqual(self.count_queries('delete', 5),
+                         self.count_queries('delete', 50))
+
+    def test_patch_removes_ingredients(self):
+        data = {'ingredients': [{'id': self.ingredients[0].id,
+                                 'amount': 2}]}
+        self.assertEqual(
+            self.count_queries('patch', 5, data=data, format='json'),
+            self.count_queries('patch', 50, data=data, format='json'))
+
+
+class RecipeValidationTest(RecipeWriteTestCase):
+    """Проверка ингредиентов и тегов рецепта."""
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.tags = [
+            Tag.objects.create(name=f'Тег {number}',
+                               color=f'#00000{number}',
+                               slug=f'tag{number}')
+            for number in range(3)
+        ]
+
+    def payload(self, ingredients):
+        return {
+            'ingredients': ingredients,
+            'tags': [tag.id for tag in self.tags],
+            'name': 'Рецепт',
+            'text': 'Текст рецепта',
+            'cooking_time': 10,
+        }
+
+    def test_one_query_for_ingredients_and_tags(self):
+        serializer = RecipeCreateSerializer(data=self.payload([
+            {'id': ingredient.id, 'amount': 1}
+            for ingredient in self.ingredients
+        ]))
+        with self.assertNumQueries(2):
+            self.assertTrue(serializer.is_valid(), serializer.errors)
+
+    def test_unknown_id_reported_with_item_errors(self):
+        missing = max(ingredient.id for ingredient in self.ingredients) + 1
+        response = self.client.post(RECIPES_URL, self.payload([
+            {'id': missing, 'amount': 1},
+            {'id': self.ingredients[0].id, 'amount': 0},
+        ]), format='json')
+        self.assertEqual(response.status_code, 400)
+        errors = response.json()['ingredients']
+        self.assertEqual(list(errors[0]), ['id'])
+        self.assertIn(str(missing), errors[0]['id'][0])
+        self.assertEqual(list(errors[1]), ['amount'])
+
+
+class ShoppingListCacheTest(RecipeWriteTestCase):
+    """Список покупок сбрасывается после фиксации правки рецепта."""
+
+    def download(self):
+        response = self.client.get(
+            f'{RECIPES_URL}download_shopping_cart/?format=json')
+        return json.loads(b''.join(response.streaming_content))
+
+    def test_invalidated_after_commit(self):
+        recipe = self.create_recipe(2)
+        self.author.shopping_cart.create(recipe=recipe)
+        self.assertEqual(len(self.download()), 2)
+        key = shopping_list.cache_key(self.author.id, 'ingredients')
+        data = {'ingredients': [{'id': self.ingredients[0].id,
+                                 'amount': 2}]}
+        with self.captureOnCommitCallbacks() as callbacks:
+            response = self.client.patch(f'{RECIPES_URL}{recipe.id}/',
+                                         data, format='json')
+            self.assertEqual(response.status_code, 200)
+            self.assertIsNotNone(shopping_list.cache.get(key))
+        for callback in callbacks:
+            callback()
+        self.assertIsNone(shopping_list.cache.get(key))
+        self.assertEqual(len(self.download()), 1)
+
+
+class CountersSaveTest(APITestCase):
+    """Полное сохранение не затирает счётчики, изменённые через F()."""
+
+    def test_full_save_keeps_counters(self):
+        author = User.objects.create(email='author@foodgram.ru',
+                                     username='author')
+        recipe = Recipe.objects.create(
+            author=author, name='Рецепт', text='Текст рецепта',
+            cooking_time=10)
+        author = User.objects.get(id=author.id)
+        recipe = Recipe.objects.get(id=recipe.id)
+        counters.change_followers_count(author.id, 1)
+        counters.change_favorites_count(recipe.id, 1)
+        author.first_name = 'Имя'
+        author.save()
+        recipe.name = 'Новое название'
+        recipe.save()
+        author.refresh_from_db()
+        recipe.refresh_from_db()
+        self.assertEqual(author.first_name, 'Имя')
+        self.assertEqual((author.recipes_count, author.followers_count),
+                         (1, 1))
+        self.assertEqual(recipe.name, 'Новое название')
+        self.assertEqual(recipe.favorites_count, 1)
+
+    def test_profile_update_keeps_counters(self):
+        user = User.objects.create(email='user@foodgram.ru',
+                                   username='user')
+        self.client.force_authenticate(user)
+        counters.change_followers_count(user.id, 2)
+        response = self.client.patch('/api/users/me/',
+                                     {'first_name': 'Имя'}, format='json')
+        self.assertEqual(response.status_code, 200)
+        user.refresh_from_db()
+        self.assertEqual(user.followers_count, 2)
+
+    def test_admin_author_change_moves_recipes_count(self):
+        authors = [User.objects.create(email=f'author{number}@foodgram.ru',
+                                       username=f'author{number}')
+                   for number in range(2)]
+        recipe = Recipe.objects.create(
+            author=authors[0], name='Рецепт', text='Текст рецепта',
+            cooking_time=10)
+        tag = Tag.objects.create(name='Обед', color='#00FF00', slug='lunch')
+        ingredient = Ingredient.objects.create(name='соль',
+                                               measurement_unit='г')
+        model_admin = RecipeAdmin(Recipe, site)
+        request = RequestFactory().post('/')
+        request.user = User.objects.create(
+            email='admin@foodgram.ru', username='admin', is_superuser=True)
+        form = model_admin.get_form(request, recipe)({
+            'name': recipe.name,
+            'text': recipe.text,
+            'cooking_time': recipe.cooking_time,
+            'author': authors[1].id,
+            'tags': [tag.id],
+            'ingredients': [ingredient.id],
+        }, instance=recipe)
+        self.assertTrue(form.is_valid(), form.errors)
+        model_admin.save_model(request, form.save(commit=False), form, True)
+        for author, count in zip(authors, (0, 1)):
+            author.refresh_from_db()
+            self.assertEqual(author.recipes_count, count)
+
+
+class LoadDataTest(APITestCase):
+    """Загруженные справочники сразу видны в API."""
+
+    def setUp(self):
+        clear_caches()
+
+    def test_tags_and_ingredients_after_load(self):
+        self.assertEqual(self.client.get('/api/tags/').json(), [])
+        self.assertEqual(self.client.get('/api/ingredients/').json(), [])
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('load_data', stdout=StringIO())
+        tags = self.client.get('/api/tags/').json()
+        self.assertEqual(len(tags), Tag.objects.count())
+        response = self.client.get(
+            f'{RECIPES_URL}?tags={tags[0]["slug"]}')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(self.client.get('/api/ingredients/').json()),
+                         Ingredient.objects.count())
+
+    def test_not_modified_until_load(self):
+        etags = {}
+        for url in ('/api/tags/', '/api/ingredients/'):
+            with self.subTest(url=url):
+                etags[url] = self.client.get(url)['ETag']
+                response = self.client.get(
+                    url, HTTP_IF_NONE_MATCH=etags[url])
+                self.assertEqual(response.status_code, 304)
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('load_data', stdout=StringIO())
+        for url, etag in etags.items():
+            with self.subTest(url=url):
+                response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+                self.assertEqual(response.status_code, 200)
+                self.assertTrue(response.json())
+
+    def test_ingredient_index_version_after_commit(self):
+        ingredient_index.next_version()
+        before = cache.get(ingredient_index.VERSION_KEY)
+        with self.captureOnCommitCallbacks() as callbacks:
+            Ingredient.objects.create(name='соль', measurement_unit='г')
+            self.assertEqual(cache.get(ingredient_index.VERSION_KEY),
+                             before)
+        for callback in callbacks:
+            callback()
+        self.assertEqual(cache.get(ingredient_index.VERSION_KEY),
+                         before + 1)
+
+    def test_tag_registry_version_after_commit(self):
+        tag_registry.next_version()
+        before = cache.get(tag_registry.VERSION_KEY)
+        with self.captureOnCommitCallbacks() as callbacks:
+            Tag.objects.create(name='Обед', color='#00FF00', slug='lunch')
+            self.assertEqual(cache.get(tag_registry.VERSION_KEY), before)
+        for callback in callbacks:
+            callback()
+        self.assertEqual(cache.get(tag_registry.VERSION_KEY), before + 1)
+
+
+class TouchTest(APITestCase):
+    """Отметка об изменении ставится после фиксации транзакции."""
+
+    def test_touch_after_commit(self):
+        before = changed_at([RECIPES])
+        with self.captureOnCommitCallbacks() as callbacks:
+            touch(RECIPES)
+            self.assertEqual(changed_at([RECIPES]), before)
+        for callback in callbacks:
+            callback()
+        self.assertNotEqual(changed_at([RECIPES]), before)
+
+    def test_user_save_touches_recipes_of_changed_author(self):
+        user = User.objects.create(email='user@foodgram.ru',
+                                   username='user')
+        author = User.objects.create(email='author@foodgram.ru',
+                                     username='author')
+        Recipe.objects.create(author=author, name='Рецепт',
+                              text='Текст рецепта', cooking_time=10)
+        saves = (
+            (User.objects.get(id=user.id), 'Имя', False),
+            (User.objects.get(id=author.id), '', False),
+            (User.objects.get(id=author.id), 'Имя', True),
+        )
+        for instance, first_name, touched in saves:
+            with self.subTest(username=instance.username,
+                              first_name=first_name):
+                before = changed_at([RECIPES])
+                instance.first_name = first_name
+                with self.captureOnCommitCallbacks(execute=True):
+                    instance.save()
+                self.assertEqual(changed_at([RECIPES]) != before, touched)
+
+
+class RecipeFragmentsTest(APITestCase):
+    """Сброс фрагментов после фиксации и сохранение под ключами чтения."""
+
+    def setUp(self):
+        clear_caches()
+
+    def test_invalidate_after_commit(self):
+        recipe_fragments.set_many(
+            {1: 'old'}, recipe_fragments.fragment_keys([1]))
+        with self.captureOnCommitCallbacks() as callbacks:
+            recipe_fragments.invalidate([1])
+            self.assertEqual(recipe_fragments.get_many([1])[0], {1: 'old'})
+        for callback in callbacks:
+            callback()
+        self.assertEqual(recipe_fragments.get_many([1])[0], {})
+
+    def test_set_under_keys_of_get(self):
+        for invalidate in (lambda: recipe_fragments.invalidate([1]),
+                           recipe_fragments.invalidate_all):
+            with self.subTest(invalidate=invalidate):
+                clear_caches()
+                # Фрагмент построен по данным, прочитанным до сброса.
+                fragments, keys = recipe_fragments.get_many([1, 2])
+                self.assertEqual(fragments, {})
+                with self.captureOnCommitCallbacks(execute=True):
+                    invalidate()
+                recipe_fragments.set_many({1: 'old', 2: 'old'}, keys)
+                self.assertEqual(recipe_fragments.get_many([1])[0], {})
+
+    def test_invalidate_keeps_other_recipes(self):
+        recipe_fragments.set_many(
+            {1: 'one', 2: 'two'}, recipe_fragments.fragment_keys([1, 2]))
+        with self.captureOnCommitCallbacks(execute=True):
+            recipe_fragments.invalidate([1])
+        self.assertEqual(recipe_fragments.get_many([1, 2])[0], {2: 'two'})
+
+
+class RecipeImageTest(APITestCase):
+    """Загрузка до обработки закрыта и в API не видна."""
+
+    def setUp(self):
+        clear_caches()
+        media_root = tempfile.mkdtemp()
+        upload_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        self.addCleanup(shutil.rmtree, upload_root)
+        settings = override_settings(MEDIA_ROOT=media_root,
+                                     IMAGE_UPLOAD_ROOT=upload_root,
+                                     IMAGE_WORKERS=0)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.media_root = media_root
+        self.user = User.objects.create(email='user@foodgram.ru',
+                                        username='user')
+        self.tag = Tag.objects.create(name='Завтрак', color='#E26C2D',
+                                      slug='breakfast')
+        self.ingredient = Ingredient.objects.create(name='Соль',
+                                                    measurement_unit='г')
+        self.client.force_authenticate(self.user)
+
+    def payload(self, truncate=False):
+        buffer = io.BytesIO()
+        Image.effect_noise((200, 150), 50).convert('RGB').save(
+            buffer, 'JPEG')
+        content = buffer.getvalue()
+        if truncate:
+            content = content[:len(content) // 2]
+        encoded = base64.b64encode(content).decode()
+        return {
+            'ingredients': [{'id': self.ingredient.id, 'amount': 10}],
+            'tags': [self.tag.id],
+            'image': f'data:image/jpeg;base64,{encoded}',
+            'name': 'Рецепт',
+            'text': 'Текст рецепта',
+            'cooking_time': 10,
+        }
+
+    def media_files(self):
+        return [os.path.join(root, name)
+                for root, _, names in os.walk(self.media_root)
+                for name in names]
+
+    def test_image_hidden_until_processed(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            response = self.client.post(RECIPES_URL, self.payload(),
+                                        format='json')
+        self.assertEqual(response.status_code, 201)
+        data = response.json()
+        self.assertIsNone(data['image'])
+        self.assertEqual(data['image_srcset'], {})
+        self.assertEqual(data['image_status'], Recipe.IMAGE_PROCESSING)
+        recipe = Recipe.objects.get(id=data['id'])
+        self.assertFalse(recipe.image)
+        self.assertTrue(images.upload_storage.exists(recipe.image_upload))
+        self.assertEqual(self.media_files(), [])
+        for callback in callbacks:
+            callback()
+        upload = recipe.image_upload
+        recipe.refresh_from_db()
+        self.assertEqual(recipe.image_status, Recipe.IMAGE_READY)
+        self.assertEqual(recipe.image_upload, '')
+        self.assertFalse(images.upload_storage.exists(upload))
+        clear_caches()
+        data = self.client.get(f'{RECIPES_URL}{recipe.id}/').json()
+        self.assertTrue(data['image'].endswith(recipe.image.url))
+        self.assertEqual(data['image_status'], Recipe.IMAGE_READY)
+
+    def test_invalid_image_fails(self):
+        with self.assertLogs('api.images', 'WARNING'), \
+                self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(RECIPES_URL,
+                                        self.payload(truncate=True),
+                                        format='json')
+        self.assertEqual(response.status_code, 201)
+        recipe = Recipe.objects.get(id=response.json()['id'])
+        self.assertEqual(recipe.image_status, Recipe.IMAGE_FAILED)
+        self.assertFalse(recipe.image)
+        self.assertEqual(self.media_files(), [])
+
+    def processed_files(self, recipe):
+        return [recipe.image.path] + [
+            thumbnails.storage.path(variant)
+            for items in recipe.image_variants.values()
+            for _, variant in items
+        ]
+
+    def test_files_restored_after_concurrent_delete(self):
+        finish = images.finish
+
+        def finish_and_delete(recipe_id, source, **fields):
+            # Другой рецепт с той же картинкой удаляет её файлы
+            # сразу после фиксации ссылки на них.
+            updated = finish(recipe_id, source, **fields)
+            for path in self.media_files():
+                os.remove(path)
+            return updated
+
+        with mock.patch.object(images, 'finish', finish_and_delete), \
+                self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(RECIPES_URL, self.payload(),
+                                        format='json')
+        recipe = Recipe.objects.get(id=response.json()['id'])
+        self.assertEqual(recipe.image_status, Recipe.IMAGE_READY)
+        for path in self.processed_files(recipe):
+            self.assertTrue(os.path.exists(path), path)
+
+    def test_delete_unused_keeps_files_referenced_meanwhile(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(RECIPES_URL, self.payload(),
+                                        format='json')
+        recipe = Recipe.objects.get(id=response.json()['id'])
+        files = self.processed_files(recipe)
+        # Ссылка появляется между проверкой и удалением.
+        with mock.patch.object(images, 'referenced',
+                               side_effect=[False, True]):
+            images.delete_unused(recipe.image.name, recipe.image_variants)
+        self.assertEqual(sorted(self.media_files()), sorted(files))
+        with self.captureOnCommitCallbacks(execute=True):
+            recipe.delete()
+        self.assertEqual(self.media_files(), [])
+
+    def test_rows_match_serializer(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            recipe_id = self.client.post(RECIPES_URL, self.payload(),
+                                         format='json').json()['id']
+        for processed in (False, True):
+            with self.subTest(processed=processed):
+                recipe = Recipe.objects.with_relations(
+                    AnonymousUser()).get(id=recipe_id)
+                expected = RecipeReadSerializer().fragment(recipe)
+                fragment = recipe_rows.build_fragments([recipe_id])
+                self.assertEqual(list(fragment[recipe_id].items()),
+                                 list(expected.items()))
+            if not processed:
+                for callback in callbacks:
+                    callback()
@@ -0,0 +1,86 @@
+"""
+Уменьшенные копии картинок рецептов в исходном формате и WebP.
+Имена строятся по хешу содержимого картинки, поэтому каждая
+копия создаётся один раз и не пересоздаётся для той же картинки.
+Копии лежат в основном хранилище: имена им задаются здесь.
+"""
+import hashlib
+import io
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage as storage
+from PIL import features
+
+VARIANTS_DIR = 'recipes/variants'
+EXTENSIONS = {'JPEG': 'jpg', 'PNG': 'png', 'WEBP': 'webp'}
+# WebP доступен, если Pillow собран с libwebp.
+EXTRA_FORMATS = ('WEBP',) if features.check('webp') else ()
+
+
+def encode(image, format):
+    buffer = io.BytesIO()
+    if format == 'PNG':
+        image.save(buffer, format, optimize=True)
+    elif format == 'JPEG':
+        image.save(buffer, format, quality=settings.RECIPE_IMAGE_QUALITY,
+                   optimize=True, progressive=True)
+    else:
+        image.save(buffer, format, quality=settings.RECIPE_IMAGE_QUALITY)
+    return buffer.getvalue()
+
+
+def variant_name(digest, width, format):
+    return (f'{VARIANTS_DIR}/{digest[:2]}/'
+            f'{digest}-{width}.{EXTENSIONS[format]}')
+
+
+def save_variant(name, image, width, format):
+    if storage.exists(name):
+        return
+    variant = image.copy()
+    variant.thumbnail((width, image.height))
+    saved = storage.save(name, ContentFile(encode(variant, format)))
+    if saved != name:
+        # Ту же копию параллельно сохранил другой поток.
+        storage.delete(saved)
+
+
+def generate(image, content, format):
+    """
+    Копии ширины RECIPE_IMAGE_WIDTHS (не шире самой картинки)
+    в формате format и в WebP, если он доступен:
+    {'jpeg': [[ширина, имя], ...], 'webp': [...]}.
+    """
+    digest = hashlib.sha256(content).hexdigest()
+    widths = sorted({min(width, image.width)
+                     for width in settings.RECIPE_IMAGE_WIDTHS})
+    variants = {}
+    for variant_format in (format, *EXTRA_FORMATS):
+        variants[variant_format.lower()] = [
+            [width, variant_name(digest, width, variant_format)]
+            for width in widths
+        ]
+        for width, name in variants[variant_format.lower()]:
+            save_variant(name, image, width, variant_format)
+    return variants
+
+
+def srcset(variants, url):
+    """Строки srcset по форматам; url строит ссылку по имени файла."""
+    return {
+        format: ', '.join(f'{url(name)} {width}w' for width, name in items)
+        for format, items in variants.items()
+    }
+
+
+def absolute(srcsets, request):
+    """Относительные ссылки srcset в абсолютные для запроса."""
+    return {
+        format: ', '.join(
+            f'{request.build_absolute_uri(url)} {width}'
+            for url, width in (item.rsplit(' ', 1)
+                               for item in value.split(', '))
+        )
+        for format, value in srcsets.items()
+    }
@@ -1,21 +1,18 @@
-import io
-
 from rest_framework import viewsets, status
 from django.shortcuts import get_object_or_404
 from rest_framework.viewsets import ReadOnlyModelViewSet
 from rest_framework.permissions import (IsAuthenticatedOrReadOnly,
                                         IsAuthenticated,
                                         SAFE_METHODS)
-from rest_framework.filters import SearchFilter
+from rest_framework.exceptions import NotFound
 from rest_framework.response import Response
 from djoser.views import UserViewSet
 from rest_framework.decorators import action
 from django_filters.rest_framework import DjangoFilterBackend
-from django.http import FileResponse
-from reportlab.pdfgen import canvas
-from reportlab.pdfbase import pdfmetrics, ttfonts
-from django.db.models import Sum
-from django.conf import settings
+from django.db import transaction
+from django.db.models import (BooleanField, Prefetch, Value,
+                              prefetch_related_objects)
+from django.http import FileResponse, StreamingHttpResponse
 
 from api.serializers import (UserCreateSerializer,
                              UserReadSerializer,
@@ -30,12 +27,28 @@ from api.serializers import (UserCreateSerializer,
                              )
 from recipes.models import (Ingredient,
                             Tag,
-                            Recipe,
-                            IngredientAmount)
+                            Recipe)
+from recipes import counters
 from users.models import User
 from api.permissions import IsAmdinOrReadOnly, IsOwnerOrReadOnly
 from api.paginations import RecipePagination
-from api.filters import RecipeFilter, IngredientFilter
+from api.filters import RecipeFilter
+from api.ingredient_index import ingredient_index
+from api.response_cache import cache_anonymous
+from api.tag_registry import tag_registry
+from api.renderers import (FastJSONRenderer,
+                           PDFRenderer,
+                           PlainTextRenderer,
+                           CSVRenderer)
+from api import recipe_counts, shopping_list
+from api.conditional import (INGREDIENTS,
+                             RECIPES,
+                             TAGS,
+                             conditional,
+                             touch_user)
+
+# Сколько секунд общие кеши могут хранить справочники.
+CATALOG_MAX_AGE = 60
 
 
 class CustomUserViewSet(UserViewSet):
@@ -43,11 +56,30 @@ class CustomUserViewSet(UserViewSet):
     queryset = User.objects.all()
     permission_classes = [IsAuthenticatedOrReadOnly, ]
     pagination_class = RecipePagination
+    cursor_ordering = ('id',)
 
     def get_serializer_class(self):
         if self.action == 'create':
             return UserCreateSerializer
-        return UserReadSerializer
+        if self.action in ('list', 'retrieve', 'me'):
+            return UserReadSerializer
+        # Смена пароля и остальные действия djoser.
+        return super().get_serializer_class()
+
+    def with_recipes(self, authors):
+        """
+        Последние рецепты авторов страницы,
+        загруженные для всех авторов сразу.
+        """
+        limit = SubscribeSerializer.get_recipes_limit(self.request)
+        prefetch_related_objects(authors, Prefetch(
+            'recipes',
+            queryset=Recipe.objects.latest_by_author(limit, authors).only(
+                'id', 'name', 'image', 'image_status', 'image_variants',
+                'cooking_time', 'author'),
+            to_attr='latest_recipes'
+        ))
+        return authors
 
     @action(
         detail=True,
@@ -56,27 +88,30 @@ class CustomUserViewSet(UserViewSet):
         url_path='subscribe'
     )
     def subscribe(self, request, id=None):
-        author = get_object_or_404(User, id=id)
         user = request.user
         if request.method == 'POST':
+            author = get_object_or_404(User, id=id)
+            self.with_recipes([author])
             serializer = SubscribeCreateSerializer(
-                data={
-                    'user': user.id,
-                    'author': author.id
-                },
-                context={'request': request}
+                data={}, context={'request': request, 'author': author}
             )
             serializer.is_valid(raise_exception=True)
-            serializer.save()
-            return Response(serializer.data, status=status.HTTP_201_CREATED)
+            author.is_subscribed = True
+            serializer.save(user=user, author=author)
+            return Response(serializer.data,
+                            status=status.HTTP_201_CREATED)
 
         if request.method == 'DELETE':
-            subscription = user.subscriber.filter(author=author)
-            if subscription.exists():
-                subscription.delete()
+            with transaction.atomic():
+                deleted, _ = user.subscriber.filter(author_id=id).delete()
+                if deleted:
+                    counters.change_followers_count(id, -deleted)
+            if deleted:
+                touch_user(user.id)
                 return Response(
                     {'message': 'Вы больше не подписаны на пользователя'},
                     status=status.HTTP_204_NO_CONTENT)
+            get_object_or_404(User, id=id)
             return Response(
                 {'errors': 'Вы не подписаны на этого пользователя!'},
                 status=status.HTTP_400_BAD_REQUEST)
@@ -86,8 +121,12 @@ class CustomUserViewSet(UserViewSet):
         permission_classes=[IsAuthenticated, ],
     )
     def subscriptions(self, request):
-        queryset = User.objects.filter(subscribing__user=request.user)
-        pag_queryset = self.paginate_queryset(queryset)
+        queryset = User.objects.filter(
+            subscribing__user=request.user
+        ).order_by('id').annotate(
+            is_subscribed=Value(True, output_field=BooleanField())
+        )
+        pag_queryset = self.with_recipes(self.paginate_queryset(queryset))
         serializer = SubscribeSerializer(pag_queryset,
                                          many=True,
                                          context={'request': request})
@@ -95,21 +134,50 @@ class CustomUserViewSet(UserViewSet):
 
 
 class IngredientViewSet(ReadOnlyModelViewSet):
-    """Вьюсет для просмотра ингредиентов."""
+    """Вьюсет для просмотра ингредиентов.
+       Список, поиск и отдельный ингредиент обслуживаются
+       индексом в памяти. Поиск идёт по началу названия
+       или, с mode=ranked, ранжированный поиск с вхождениями
+       и похожими названиями."""
     queryset = Ingredient.objects.all()
     permission_classes = [IsAmdinOrReadOnly]
     serializer_class = IngredientSerializer
-    filter_backends = (SearchFilter,)
-    filterset_class = IngredientFilter
-    search_fields = ('^name',)
+
+    @conditional(INGREDIENTS, public=True, max_age=CATALOG_MAX_AGE)
+    def list(self, request, *args, **kwargs):
+        name = request.query_params.get('name', '')
+        if request.query_params.get('mode') == 'ranked':
+            return Response(ingredient_index.search(name))
+        return Response(ingredient_index.startswith(name))
+
+    @conditional(INGREDIENTS, public=True, max_age=CATALOG_MAX_AGE)
+    def retrieve(self, request, *args, **kwargs):
+        pk = self.kwargs['pk']
+        ingredient = ingredient_index.get(int(pk)) if pk.isdigit() else None
+        if ingredient is None:
+            raise NotFound
+        return Response(ingredient)
 
 
 class TagViewSet(ReadOnlyModelViewSet):
-    """Вьюсет для просмотра тегов."""
+    """Вьюсет для просмотра тегов.
+       Теги отдаются из реестра в памяти без запросов к базе."""
     queryset = Tag.objects.all()
     serializer_class = TagSerializer
     permission_classes = [IsAmdinOrReadOnly]
 
+    @conditional(TAGS, public=True, max_age=CATALOG_MAX_AGE)
+    def list(self, request, *args, **kwargs):
+        return Response(tag_registry.all())
+
+    @conditional(TAGS, public=True, max_age=CATALOG_MAX_AGE)
+    def retrieve(self, request, *args, **kwargs):
+        pk = self.kwargs['pk']
+        tag = tag_registry.get(int(pk)) if pk.isdigit() else None
+        if tag is None:
+            raise NotFound
+        return Response(tag)
+
 
 class RecipeViewSet(viewsets.ModelViewSet):
     """Вьюсет рецепта.
@@ -119,10 +187,34 @@ class RecipeViewSet(viewsets.ModelViewSet):
     pagination_class = RecipePagination
     filter_backends = (DjangoFilterBackend,)
     filterset_class = RecipeFilter
+    cache_count = True
+
+    def get_queryset(self):
+        if self.request.method in SAFE_METHODS:
+            # Остальное представление берётся из кеша фрагментов.
+            return Recipe.objects.with_flags(self.request.user).only(
+                'id', 'author', 'pub_date')
+        return super().get_queryset()
+
+    @conditional(RECIPES, user=True)
+    @cache_anonymous(RECIPES)
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+
+    @conditional(RECIPES, user=True)
+    @cache_anonymous(RECIPES)
+    def retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
 
     def perform_create(self, serializer):
         serializer.save(author=self.request.user)
 
+    def handle_exception(self, exc):
+        if self.action == 'download_shopping_cart':
+            self.request.accepted_renderer = FastJSONRenderer()
+            self.request.accepted_media_type = FastJSONRenderer.media_type
+        return super().handle_exception(exc)
+
     def get_serializer_class(self):
         if self.request.method in SAFE_METHODS:
             return RecipeReadSerializer
@@ -130,13 +222,14 @@ class RecipeViewSet(viewsets.ModelViewSet):
 
     @staticmethod
     def create_obj(request, pk, serializers):
-        user = request.user
-        recipe = get_object_or_404(Recipe, id=pk)
-        data = {'user': user.id,
-                'recipe': recipe.pk}
-        serializer = serializers(data=data, context={'request': request})
+        recipe = get_object_or_404(
+            Recipe.objects.only('id', 'name', 'image', 'image_status',
+                                'image_variants', 'cooking_time'),
+            id=pk
+        )
+        serializer = serializers(data={}, context={'request': request})
         serializer.is_valid(raise_exception=True)
-        serializer.save()
+        serializer.save(user=request.user, recipe=recipe)
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
     @action(
@@ -152,9 +245,14 @@ class RecipeViewSet(viewsets.ModelViewSet):
                 serializers=FavoriteSerializer)
 
         if request.method == 'DELETE':
-            fav_rec = request.user.favorites.filter(recipe_id=pk)
-            if fav_rec.exists():
-                fav_rec.delete()
+            with transaction.atomic():
+                deleted, _ = request.user.favorites.filter(
+                    recipe_id=pk).delete()
+                if deleted:
+                    counters.change_favorites_count(pk, -deleted)
+            if deleted:
+                recipe_counts.invalidate(request.user.id)
+                touch_user(request.user.id)
                 return Response(
                     {'message': 'Рецепт удален из избранного'},
                     status=status.HTTP_204_NO_CONTENT)
@@ -175,9 +273,12 @@ class RecipeViewSet(viewsets.ModelViewSet):
                 pk=pk,
                 serializers=ShoppingCartSerializer)
         if request.method == 'DELETE':
-            rec_in_cart = request.user.shopping_cart.filter(recipe_id=pk)
-            if rec_in_cart.exists():
-                rec_in_cart.delete()
+            deleted, _ = request.user.shopping_cart.filter(
+                recipe_id=pk).delete()
+            if deleted:
+                shopping_list.invalidate([request.user.id])
+                recipe_counts.invalidate(request.user.id)
+                touch_user(request.user.id)
                 return Response(
                     {'message': 'Рецепт удален из списка покупок'},
                     status=status.HTTP_204_NO_CONTENT)
@@ -188,31 +289,23 @@ class RecipeViewSet(viewsets.ModelViewSet):
     @action(
         detail=False,
         methods=['get'],
-        permission_classes=(IsAuthenticated,))
+        permission_classes=(IsAuthenticated,),
+        renderer_classes=(PDFRenderer,
+                          PlainTextRenderer,
+                          CSVRenderer,
+                          FastJSONRenderer))
     def download_shopping_cart(self, request):
-        user = request.user
-        buffer = io.BytesIO()
-        ingredients = IngredientAmount.objects.filter(
-            recipe__recipe_shopping_cart__user=user).values(
-                'ingredient__name', 'ingredient__measurement_unit').annotate(
-                amount=Sum('amount'))
-        shopping_list = ([f'{i["ingredient__name"]}'
-                          f' - {i["amount"]}'
-                          f' {i["ingredient__measurement_unit"]}'
-                          for i in ingredients])
-        text = canvas.Canvas(buffer)
-        font = ttfonts.TTFont('Arial', './docs/arialfont.ttf')
-        pdfmetrics.registerFont(font)
-        text.setFont('Arial', settings.HEAD_FONT_SIZE)
-        text.drawString(settings.HEAD_INDENT, settings.HEAD_HEIGHT,
-                        'Ваш список покупок:')
-        text.setFont('Arial', settings.TEXT_FONT_SIZE)
-        for line in shopping_list:
-            text.drawString(settings.TEXT_INDENT, settings.TEXT_HEIGHT, line)
-            settings.TEXT_HEIGHT -= settings.LINE_SPACE
-        text.showPage()
-        text.save()
-        buffer.seek(0)
-        return FileResponse(buffer,
-                            as_attachment=True,
-                            filename='shopping_cart.pdf')
+        renderer = request.accepted_renderer
+        filename = f'shopping_cart.{renderer.format}'
+        if renderer.format == PDFRenderer.format:
+            return FileResponse(shopping_list.get_pdf(request.user),
+                                as_attachment=True,
+                                filename=filename)
+        response = StreamingHttpResponse(
+            shopping_list.STREAMS[renderer.format](
+                shopping_list.get_ingredients(request.user)),
+            content_type=f'{renderer.media_type}; charset=utf-8'
+        )
+        response['Content-Disposition'] = (
+            f'attachment; filename="{filename}"')
+        return response
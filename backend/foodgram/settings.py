@@ -148,6 +148,30 @@ STATIC_ROOT = BASE_DIR / 'collected_static'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Cache
+# Для нескольких воркеров gunicorn нужен общий кеш, например
+# CACHE_BACKEND=django.core.cache.backends.filebased.FileBasedCache
+# и CACHE_LOCATION=/var/tmp/foodgram_cache.
+
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv(
+            'CACHE_BACKEND',
+            'django.core.cache.backends.locmem.LocMemCache'
+        ),
+        'LOCATION': os.getenv('CACHE_LOCATION', ''),
+    },
+    # Готовые ответы API для анонимных запросов.
+    'responses': {
+        'BACKEND': os.getenv(
+            'RESPONSE_CACHE_BACKEND',
+            'django.core.cache.backends.locmem.LocMemCache'
+        ),
+        'LOCATION': os.getenv('RESPONSE_CACHE_LOCATION', 'responses'),
+        'TIMEOUT': int(os.getenv('RESPONSE_CACHE_TIMEOUT', 5 * 60)),
+    },
+}
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.2/ref/settings/#default-auto-field
 
@@ -164,6 +188,10 @@ REST_FRAMEWORK = {
         'rest_framework.authentication.TokenAuthentication',
     ),
     'SEARCH_PARAM': 'name',
+    'DEFAULT_RENDERER_CLASSES': (
+        'api.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ),
 }
 
 DJOSER = {
@@ -184,7 +212,27 @@ HEAD_HEIGHT = 800
 HEAD_INDENT = 200
 TEXT_HEIGHT = 750
 TEXT_INDENT = 50
+TEXT_BOTTOM = 50
 LINE_SPACE = 20
+SHOPPING_LIST_CACHE_TIMEOUT = 60 * 60
+
+# Число рецептов в постраничной выдаче
+RECIPE_COUNT_CACHE_TIMEOUT = 60
+# Без фильтров на PostgreSQL число берётся из статистики
+# планировщика, если рецептов не меньше порога.
+RECIPE_COUNT_ESTIMATE_MIN = 100000
+
+# Картинки рецептов обрабатываются в фоне пулом из IMAGE_WORKERS
+# потоков; при 0 — сразу после сохранения рецепта в запросе.
+IMAGE_WORKERS = int(os.getenv('IMAGE_WORKERS', 2))
+# Загруженные картинки до обработки: вне MEDIA_ROOT,
+# веб-сервер их не отдаёт.
+IMAGE_UPLOAD_ROOT = os.getenv('IMAGE_UPLOAD_ROOT',
+                              os.path.join(BASE_DIR, 'uploads'))
+RECIPE_IMAGE_MAX_SIDE = 2048
+RECIPE_IMAGE_QUALITY = 85
+# Ширины уменьшенных копий картинки (в исходном формате и WebP).
+RECIPE_IMAGE_WIDTHS = (320, 640, 1280)
 
 
 # validation
@@ -2,6 +2,9 @@ from import_export.admin import ImportExportActionModelAdmin
 from django.contrib import admin
 from django.contrib.admin import display
 
+from api import images, recipe_counts, recipe_fragments, shopping_list
+from api.conditional import RECIPES, touch, touch_user
+from recipes import counters
 from recipes.models import (Ingredient,
                             Tag,
                             Recipe,
@@ -41,23 +44,121 @@ class IngredientAmountAdmin(admin.TabularInline):
 
 class RecipeAdmin(admin.ModelAdmin):
     inlines = (IngredientAmountAdmin, TagInRecipeAdmin)
-    list_display = ('id', 'name', 'text', 'author', 'is_in_favorites')
-    readonly_fields = ('is_in_favorites',)
-    list_filter = ('pub_date', 'author', 'name', 'tags',)
+    list_display = ('id', 'name', 'text', 'author', 'is_in_favorites',
+                    'image_status')
+    readonly_fields = ('is_in_favorites', 'image_status')
+    list_filter = ('pub_date', 'author', 'name', 'tags', 'image_status')
     empty_value_display = '-пусто-'
 
+    def save_model(self, request, obj, form, change):
+        image_changed = 'image' in form.changed_data
+        if image_changed:
+            # Загрузка, как и через API, до обработки
+            # лежит в закрытом хранилище.
+            obj.image = form.initial.get('image') or ''
+            images.accept(obj, form.cleaned_data['image'] or None)
+        super().save_model(request, obj, form, change)
+        if change and 'author' in form.changed_data:
+            counters.change_recipes_count(form.initial['author'], -1)
+            counters.change_recipes_count(obj.author_id, 1)
+        if image_changed and obj.image_upload:
+            images.schedule(obj)
+
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        # Сигналов на строках ингредиентов нет: их массовые
+        # удаления остаются быстрыми, а кеши сбрасываются здесь.
+        if change and any(formset.model is IngredientAmount
+                          and formset.has_changed()
+                          for formset in formsets):
+            shopping_list.invalidate_recipe(form.instance.id)
+            recipe_fragments.invalidate([form.instance.id])
+            touch(RECIPES)
+
     @display(description='Добавлено в избранное')
     def is_in_favorites(self, obj):
-        return obj.favorites_recipes.count()
+        return obj.favorites_count
+
+
+class UserCacheAdmin(admin.ModelAdmin):
+    """Сбрасывает кеши пользователей при правке их связей."""
+
+    def invalidate(self, user_ids):
+        """Изменились связи пользователей: прежние ETag устаревают."""
+        for user_id in user_ids:
+            touch_user(user_id)
+
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        self.invalidate({obj.user_id, form.initial.get('user', obj.user_id)})
+
+    def delete_model(self, request, obj):
+        super().delete_model(request, obj)
+        self.invalidate([obj.user_id])
+
+    def delete_queryset(self, request, queryset):
+        user_ids = set(queryset.values_list('user_id', flat=True))
+        super().delete_queryset(request, queryset)
+        self.invalidate(user_ids)
+
+
+class ShoppingCartAdmin(UserCacheAdmin):
+    """Сбрасывает кеш списка покупок при правке корзин."""
+
+    def invalidate(self, user_ids):
+        shopping_list.invalidate(user_ids)
+        for user_id in user_ids:
+            recipe_counts.invalidate(user_id)
+        super().invalidate(user_ids)
+
+
+class CounterAdmin(admin.ModelAdmin):
+    """Поддерживает счётчик связанного объекта при правке связей."""
+    counter_field = None
+    change_counter = None
+
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        if not change:
+            self.change_counter(obj.serializable_value(self.counter_field), 1)
+        elif self.counter_field in form.changed_data:
+            self.change_counter(form.initial[self.counter_field], -1)
+            self.change_counter(obj.serializable_value(self.counter_field), 1)
+
+    def delete_model(self, request, obj):
+        super().delete_model(request, obj)
+        self.change_counter(obj.serializable_value(self.counter_field), -1)
+
+    def delete_queryset(self, request, queryset):
+        related = list(queryset.values_list(self.counter_field, flat=True))
+        super().delete_queryset(request, queryset)
+        for pk in related:
+            self.change_counter(pk, -1)
+
+
+class FavoriteAdmin(CounterAdmin, UserCacheAdmin):
+    counter_field = 'recipe'
+    change_counter = staticmethod(counters.change_favorites_count)
+
+    def invalidate(self, user_ids):
+        for user_id in user_ids:
+            recipe_counts.invalidate(user_id)
+        super().invalidate(user_ids)
+
+
+class SubscribeAdmin(CounterAdmin, UserCacheAdmin):
+    counter_field = 'author'
+    change_counter = staticmethod(counters.change_followers_count)
 
 
 class UserAdmin(admin.ModelAdmin):
-    list_display = ('email', 'username', 'first_name', 'last_name',)
+    list_display = ('email', 'username', 'first_name', 'last_name',
+                    'recipes_count', 'followers_count')
     list_filter = ('email', 'username',)
 
 
 admin.site.register(Recipe, RecipeAdmin)
-admin.site.register(Favorite)
-admin.site.register(ShoppingCart)
+admin.site.register(Favorite, FavoriteAdmin)
+admin.site.register(ShoppingCart, ShoppingCartAdmin)
 admin.site.register(User, UserAdmin)
-admin.site.register(Subscribe)
+admin.site.register(Subscribe, SubscribeAdmin)
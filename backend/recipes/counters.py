@@ -0,0 +1,62 @@
+"""
+Денормализованные счётчики: число рецептов и подписчиков
+пользователя, число добавлений рецепта в избранное.
+Меняются атомарно через F(), сверяются командой recount.
+"""
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce, Greatest
+
+from recipes.models import Favorite, Recipe, Subscribe
+from users.models import User
+
+
+def change_recipes_count(author_id, delta):
+    User.objects.filter(pk=author_id).update(
+        recipes_count=Greatest(F('recipes_count') + delta, 0))
+
+
+def change_followers_count(author_id, delta):
+    User.objects.filter(pk=author_id).update(
+        followers_count=Greatest(F('followers_count') + delta, 0))
+
+
+def change_favorites_count(recipe_id, delta):
+    Recipe.objects.filter(pk=recipe_id).update(
+        favorites_count=Greatest(F('favorites_count') + delta, 0))
+
+
+def user_deleted(user):
+    """Уменьшает счётчики, которые затронет каскадное удаление user."""
+    User.objects.filter(subscribing__user=user).update(
+        followers_count=Greatest(F('followers_count') - 1, 0))
+    Recipe.objects.filter(favorites_recipes__user=user).update(
+        favorites_count=Greatest(F('favorites_count') - 1, 0))
+
+
+def count_subquery(model, field):
+    """Число строк model, ссылающихся полем field на внешний объект."""
+    return Coalesce(Subquery(
+        model.objects.filter(
+            **{field: OuterRef('pk')}
+        ).order_by().values(field).annotate(
+            total=Count('pk')
+        ).values('total')
+    ), 0)
+
+
+def recount():
+    """
+    Пересчитывает все счётчики и исправляет только разошедшиеся.
+    Возвращает число исправленных строк по каждому счётчику.
+    """
+    counters = (
+        ('recipes_count', User, count_subquery(Recipe, 'author')),
+        ('followers_count', User, count_subquery(Subscribe, 'author')),
+        ('favorites_count', Recipe, count_subquery(Favorite, 'recipe')),
+    )
+    return {
+        name: model.objects.exclude(
+            **{name: actual}
+        ).update(**{name: actual})
+        for name, model, actual in counters
+    }
@@ -0,0 +1,49 @@
+# Generated by Django 3.2.3 on 2026-10-17 07:13
+
+from django.db import migrations, models
+
+
+def delete_duplicates(apps, schema_editor):
+    """Оставляет по одной записи на пару, чтобы создать ограничения."""
+    for model_name, fields in (('Favorite', ('user', 'recipe')),
+                               ('ShoppingCart', ('user', 'recipe')),
+                               ('Subscribe', ('user', 'author'))):
+        model = apps.get_model('recipes', model_name)
+        duplicates = model.objects.values(*fields).annotate(
+            first_id=models.Min('id'), total=models.Count('id')
+        ).filter(total__gt=1)
+        for duplicate in duplicates:
+            model.objects.filter(
+                **{field: duplicate[field] for field in fields}
+            ).exclude(id=duplicate['first_id']).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0006_ingredient_unique_ingredient'),
+    ]
+
+    operations = [
+        migrations.RunPython(delete_duplicates, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='ingredient',
+            index=models.Index(fields=['name'], name='ingredient_name_prefix_idx', opclasses=['varchar_pattern_ops']),
+        ),
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(fields=['-pub_date'], name='recipe_pub_date_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='favorite',
+            constraint=models.UniqueConstraint(fields=('user', 'recipe'), name='unique_u_f'),
+        ),
+        migrations.AddConstraint(
+            model_name='shoppingcart',
+            constraint=models.UniqueConstraint(fields=('user', 'recipe'), name='unique_s_l'),
+        ),
+        migrations.AddConstraint(
+            model_name='subscribe',
+            constraint=models.UniqueConstraint(fields=('user', 'author'), name='unique_subscribe'),
+        ),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 3.2.3 on 2026-10-17 07:18
+
+from django.db import migrations, models
+from django.db.models.functions import Coalesce
+
+
+def fill_counters(apps, schema_editor):
+    """Заполняет счётчики по уже существующим данным."""
+    User = apps.get_model('users', 'User')
+    Recipe = apps.get_model('recipes', 'Recipe')
+    Favorite = apps.get_model('recipes', 'Favorite')
+    Subscribe = apps.get_model('recipes', 'Subscribe')
+
+    def count(model, field):
+        return Coalesce(models.Subquery(
+            model.objects.filter(
+                **{field: models.OuterRef('pk')}
+            ).order_by().values(field).annotate(
+                total=models.Count('pk')
+            ).values('total')
+        ), 0)
+
+    User.objects.update(recipes_count=count(Recipe, 'author'),
+                        followers_count=count(Subscribe, 'author'))
+    Recipe.objects.update(favorites_count=count(Favorite, 'recipe'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0007_hot_lookup_constraints_and_indexes'),
+        ('users', '0003_user_counters'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='favorites_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Добавлено в избранное'),
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.2.3 on 2026-10-17 07:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0009_recipe_pub_date_id_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='image_status',
+            field=models.CharField(choices=[('ready', 'Готова'), ('processing', 'Обрабатывается'), ('failed', 'Не удалось обработать')], default='ready', editable=False, max_length=16, verbose_name='Обработка картинки'),
+        ),
+    ]
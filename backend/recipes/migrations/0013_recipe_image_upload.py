@@ -0,0 +1,18 @@
+# Generated by Django 3.2.3 on 2026-10-17 08:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0012_recipe_image_storage'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='image_upload',
+            field=models.CharField(blank=True, editable=False, max_length=255, verbose_name='Необработанная картинка'),
+        ),
+    ]
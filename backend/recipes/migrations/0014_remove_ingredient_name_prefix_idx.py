@@ -0,0 +1,17 @@
+# Generated by Django 3.2.3 on 2026-10-17 08:28
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0013_recipe_image_upload'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='ingredient',
+            name='ingredient_name_prefix_idx',
+        ),
+    ]
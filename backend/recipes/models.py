@@ -1,8 +1,10 @@
-from django.db import models
+from django.db import connection, models
+from django.db.models.functions import RowNumber
 from django.core import validators
 from django.conf import settings
 
-from users.models import User
+from recipes.storage import ContentAddressedStorage
+from users.models import CountersMixin, User
 
 
 class Ingredient(models.Model):
@@ -17,6 +19,10 @@ class Ingredient(models.Model):
         verbose_name_plural = 'Ингредиенты'
         ordering = ['name']
         db_table = 'recipes_ingredient'
+        constraints = [
+            models.UniqueConstraint(fields=['name', 'measurement_unit'],
+                                    name='unique_ingredient')
+        ]
 
     def __str__(self):
         return f'{self.name}, {self.measurement_unit}'
@@ -40,7 +46,102 @@ class Tag(models.Model):
         return self.name
 
 
-class Recipe(models.Model):
+class GroupConcat(models.Aggregate):
+    """Значения группы через запятую одной строкой."""
+    function = 'GROUP_CONCAT'
+    output_field = models.CharField()
+
+    def as_postgresql(self, compiler, connection, **extra_context):
+        return self.as_sql(
+            compiler, connection, function='STRING_AGG',
+            template="%(function)s((%(expressions)s)::text, ',')",
+            **extra_context
+        )
+
+
+class RecipeQuerySet(models.QuerySet):
+    """Выборки рецептов."""
+
+    def with_relations(self, user):
+        """
+        Рецепты для чтения: автор и ингредиенты подгружаются
+        заранее, id тегов, признаки избранного, списка
+        покупок и подписки на автора вычисляются в запросе.
+        """
+        return self.select_related('author').prefetch_related(
+            models.Prefetch(
+                'recipe',
+                queryset=IngredientAmount.objects.select_related(
+                    'ingredient'
+                ).order_by('id')
+            )
+        ).with_tag_ids().with_flags(user)
+
+    def with_tag_ids(self):
+        """id тегов рецепта строкой через запятую в tag_ids."""
+        return self.annotate(
+            tag_ids=models.Subquery(
+                Recipe.tags.through.objects.filter(
+                    recipe=models.OuterRef('pk')
+                ).order_by().values('recipe').annotate(
+                    ids=GroupConcat('tag_id')
+                ).values('ids')
+            )
+        )
+
+    def with_flags(self, user):
+        """Признаки избранного, списка покупок и подписки на автора."""
+        if user.is_anonymous:
+            return self.annotate(
+                is_favorited=models.Value(
+                    False, output_field=models.BooleanField()),
+                is_in_shopping_cart=models.Value(
+                    False, output_field=models.BooleanField()),
+                author_is_subscribed=models.Value(
+                    False, output_field=models.BooleanField()),
+            )
+        return self.annotate(
+            is_favorited=models.Exists(Favorite.objects.filter(
+                user=user, recipe=models.OuterRef('pk'))),
+            is_in_shopping_cart=models.Exists(ShoppingCart.objects.filter(
+                user=user, recipe=models.OuterRef('pk'))),
+            author_is_subscribed=models.Exists(Subscribe.objects.filter(
+                user=user, author=models.OuterRef('author'))),
+        )
+
+    def latest_by_author(self, limit=None, authors=None):
+        """
+        Не больше limit последних рецептов каждого автора из authors.
+        Рецепты авторов нумеруются ROW_NUMBER() за один проход
+        по индексу (author, -pub_date, -id), поэтому рецепты всей
+        страницы загружаются одним запросом за время, линейное
+        по числу рецептов. Без оконных функций в базе отбор
+        делается коррелированным подзапросом.
+        """
+        if limit is None:
+            return self
+        recipes = self.model.objects.order_by()
+        if authors is not None:
+            recipes = recipes.filter(author__in=authors)
+        if not connection.features.supports_over_clause:
+            return self.filter(id__in=models.Subquery(
+                recipes.filter(
+                    author=models.OuterRef('author')
+                ).order_by('-pub_date', '-id').values('id')[:limit]
+            ))
+        numbered = recipes.annotate(recipe_number=models.Window(
+            RowNumber(),
+            partition_by=[models.F('author')],
+            order_by=[models.F('pub_date').desc(), models.F('id').desc()],
+        )).values('id', 'recipe_number')
+        sql, params = numbered.query.sql_with_params()
+        return self.filter(id__in=models.expressions.RawSQL(
+            f'SELECT id FROM ({sql}) latest WHERE recipe_number <= %s',
+            (*params, limit)
+        ))
+
+
+class Recipe(CountersMixin, models.Model):
     """Модель рецепта."""
     tags = models.ManyToManyField(
         Tag,
@@ -57,10 +158,40 @@ class Recipe(models.Model):
         max_length=100,
         verbose_name='Название рецепта',
     )
+    IMAGE_READY = 'ready'
+    IMAGE_PROCESSING = 'processing'
+    IMAGE_FAILED = 'failed'
+    IMAGE_STATUSES = (
+        (IMAGE_READY, 'Готова'),
+        (IMAGE_PROCESSING, 'Обрабатывается'),
+        (IMAGE_FAILED, 'Не удалось обработать'),
+    )
+
     image = models.ImageField(
         'Картинка',
         upload_to='recipes/',
-        blank=True
+        storage=ContentAddressedStorage(),
+        blank=True,
+        db_index=True
+    )
+    image_status = models.CharField(
+        max_length=16,
+        choices=IMAGE_STATUSES,
+        default=IMAGE_READY,
+        editable=False,
+        verbose_name='Обработка картинки'
+    )
+    image_variants = models.JSONField(
+        default=dict,
+        blank=True,
+        editable=False,
+        verbose_name='Уменьшенные копии картинки'
+    )
+    image_upload = models.CharField(
+        max_length=255,
+        blank=True,
+        editable=False,
+        verbose_name='Необработанная картинка'
     )
     text = models.TextField(verbose_name='Текст рецепта',
                             help_text='Введите текст рецепта',
@@ -79,11 +210,26 @@ class Recipe(models.Model):
         verbose_name='Дата публикации',
         auto_now_add=True
     )
+    favorites_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='Добавлено в избранное'
+    )
+
+    counter_fields = ('favorites_count',)
+
+    objects = RecipeQuerySet.as_manager()
 
     class Meta:
-        ordering = ['-pub_date']
+        ordering = ['-pub_date', '-id']
         verbose_name = 'Рецепт'
         verbose_name_plural = 'Рецепты'
+        indexes = [
+            models.Index(fields=['-pub_date', '-id'],
+                         name='recipe_pub_date_id_idx'),
+            models.Index(fields=['author', '-pub_date', '-id'],
+                         name='recipe_author_pub_date_idx'),
+        ]
 
     def __str__(self):
         return self.name
@@ -131,8 +277,10 @@ class Favorite(models.Model):
         ordering = ['recipe']
         verbose_name = 'Избранное'
         verbose_name_plural = 'Избранное'
-        models.UniqueConstraint(fields=['user', 'recipe'],
-                                name='unique_u_f')
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'recipe'],
+                                    name='unique_u_f')
+        ]
 
     def __str__(self):
         return f'Рецепт {self.recipe} в избранном у {self.user}'
@@ -157,8 +305,10 @@ class ShoppingCart(models.Model):
         ordering = ['recipe']
         verbose_name = 'Список покупок'
         verbose_name_plural = 'Списки покупок'
-        models.UniqueConstraint(fields=['user', 'recipe'],
-                                name='unique_s_l')
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'recipe'],
+                                    name='unique_s_l')
+        ]
 
     def __str__(self):
         return f'Рецепт {self.recipe} в списке покупок у {self.user}'
@@ -183,6 +333,10 @@ class Subscribe(models.Model):
         ordering = ['author']
         verbose_name = 'Подписка'
         verbose_name_plural = 'Подписки'
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'author'],
+                                    name='unique_subscribe')
+        ]
 
     def __str__(self):
         return f'{self.user} подписан на {self.author}'
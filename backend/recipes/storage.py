@@ -0,0 +1,83 @@
+"""
+Хранилище картинок рецептов с адресацией по содержимому:
+файл называется по SHA-256 своих байтов, поэтому одинаковые
+картинки хранятся один раз, а повторная загрузка не пишет на диск.
+"""
+import hashlib
+import os
+import re
+
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage
+from django.utils.deconstruct import deconstructible
+from django.utils.functional import cached_property
+
+HASHED_NAME = re.compile(r'[0-9a-f]{64}(\.\w+)?$')
+
+
+def content_digest(content):
+    """SHA-256 файла, прочитанного по частям."""
+    digest = hashlib.sha256()
+    content.seek(0)
+    for chunk in content.chunks():
+        digest.update(chunk)
+    content.seek(0)
+    return digest.hexdigest()
+
+
+def stored_digest(name):
+    """Хеш из имени файла этого хранилища или None для прежних имён."""
+    filename = os.path.basename(name)
+    if not HASHED_NAME.match(filename):
+        return None
+    return os.path.splitext(filename)[0]
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    Имя файла — каталог из исходного имени, первые два
+    символа хеша и сам хеш с исходным расширением:
+    recipes/temp.jpg -> recipes/ab/ab12....jpg.
+    """
+
+    def hashed_name(self, name, digest):
+        directory, filename = os.path.split(name)
+        extension = os.path.splitext(filename)[1].lower()
+        return os.path.join(directory, digest[:2], digest + extension)
+
+    def get_available_name(self, name, max_length=None):
+        # Окончательное имя определяется содержимым в _save.
+        # С уже хешированным именем сюда попадают, только если
+        # тот же файл одновременно записал другой поток.
+        if HASHED_NAME.match(os.path.basename(name)) and self.exists(name):
+            raise FileExistsError(name)
+        return name
+
+    def _save(self, name, content):
+        name = self.hashed_name(name, content_digest(content))
+        if self.exists(name):
+            return name
+        try:
+            return super()._save(name, content)
+        except FileExistsError:
+            return name
+
+
+@deconstructible
+class UploadStorage(FileSystemStorage):
+    """
+    Закрытое хранилище необработанных загрузок в IMAGE_UPLOAD_ROOT:
+    вне MEDIA_ROOT, поэтому веб-сервер эти файлы не отдаёт.
+    """
+
+    @cached_property
+    def base_location(self):
+        return self._value_or_setting(self._location,
+                                      settings.IMAGE_UPLOAD_ROOT)
+
+    def _clear_cached_properties(self, setting, **kwargs):
+        super()._clear_cached_properties(setting, **kwargs)
+        if setting == 'IMAGE_UPLOAD_ROOT':
+            self.__dict__.pop('base_location', None)
+            self.__dict__.pop('location', None)
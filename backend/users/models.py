@@ -2,7 +2,27 @@ from django.db import models
 from django.contrib.auth.models import AbstractUser
 
 
-class User(AbstractUser):
+class CountersMixin:
+    """
+    Счётчики меняются только атомарно через F() (recipes.counters).
+    Полное сохранение объекта их не записывает: прочитанные
+    вместе с объектом значения могли устареть.
+    """
+    counter_fields = ()
+
+    def save(self, *args, **kwargs):
+        if (not self._state.adding
+                and not kwargs.get('force_insert')
+                and kwargs.get('update_fields') is None):
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key
+                and field.name not in self.counter_fields
+            ]
+        super().save(*args, **kwargs)
+
+
+class User(CountersMixin, AbstractUser):
     """Абстрактная модель пользователя."""
     email = models.EmailField(
         verbose_name='email',
@@ -21,6 +41,20 @@ class User(AbstractUser):
         max_length=40,
         verbose_name='Фамилия'
     )
+    recipes_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='Число рецептов'
+    )
+    followers_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='Число подписчиков'
+    )
+
+    counter_fields = ('recipes_count', 'followers_count')
+    # Поля, которые входят в выдачу рецептов автора.
+    author_fields = ('email', 'username', 'first_name', 'last_name')
 
     USERNAME_FIELD = 'email'
     REQUIRED_FIELDS = [
@@ -36,3 +70,26 @@ class User(AbstractUser):
 
     def __str__(self):
         return self.username
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance.saved_author_data = instance.author_data()
+        return instance
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        self.saved_author_data = self.author_data()
+
+    def author_data(self):
+        """Загруженные значения полей автора."""
+        return {name: self.__dict__[name] for name in self.author_fields
+                if name in self.__dict__}
+
+    def author_changed(self):
+        """
+        Изменились ли поля автора с загрузки или прошлого сохранения.
+        Объект, созданный не из базы, считается изменённым.
+        """
+        saved = getattr(self, 'saved_author_data', None)
+        return saved is None or self.author_data() != saved